@@ -0,0 +1,248 @@
+"""
+BitShares.org StakeMachine
+Optional Asyncio Runtime
+block ingestion, payment scheduling and balance monitoring as tasks on one event loop
+async websocket rpc for the node and async http for bittrex
+the business logic of stake_bitshares.py is reused unchanged
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import asyncio
+import time
+
+# THIRD PARTY MODULES
+import aiohttp
+from bitshares.aio.bitshares import BitShares
+
+# STAKE BTS MODULES
+from bittrex_api import TIMEOUT, Bittrex
+from config import (AIO_BACKOFF, AIO_RPC_WINDOW, BALANCE_TIMEOUT,
+                    BLOCK_CHECKPOINT, DEV, INGEST, NODE)
+from db_migrate import migrate
+from logger import log
+from payment_queue import payment_workers
+from rpc import (balance_bittrex_store, bittrex_available,
+                 get_block_num_current, withdrawals_reconcile)
+from scheduler import schedule_load, schedule_wait
+from stake_bitshares import (balances_report, check_block,
+                             get_block_num_database, listener_bitshares, login,
+                             metrics_start, payment_child, payments_process,
+                             set_block_num_database, welcome)
+from utilities import exception_handler, it, line_info
+
+
+def to_thread(func, *args):
+    """
+    run blocking stake_bitshares logic on the default executor, python 3.8 safe
+    :return asyncio.Future:
+    """
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class AioBittrex(Bittrex):
+    """
+    Client for Bittrex V3 API on the event loop
+    all three corporate accounts share one aiohttp session
+    """
+
+    def __init__(self, api_key, api_secret, session):
+        # pylint: disable=super-init-not-called
+        self.response = ""
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.session = session
+
+    async def _authenticated_request(self, method, endpoint, **kwargs):
+        uri, headers, request_data = self._sign(method, endpoint, kwargs)
+        timeout = aiohttp.ClientTimeout(sock_connect=TIMEOUT[0], sock_read=TIMEOUT[1])
+        async with self.session.request(
+            method.upper(), uri, headers=headers, timeout=timeout, **request_data
+        ) as response:
+            self.response = response
+            return await response.json(content_type=None)
+
+
+# ASYNC BITTREX BALANCES
+async def aio_balance_bittrex(clients):
+    """
+    bittrex BTS balances for all three corporate accounts, fetched concurrently
+    :param dict(clients): {api: AioBittrex()}
+    :return tuple(dict(balances), dict(failed)): see get_balance_bittrex_report()
+    """
+
+    async def balance(api):
+        ret = await asyncio.wait_for(clients[api].get_balances(), BALANCE_TIMEOUT)
+        return bittrex_available(ret)
+
+    results = await asyncio.gather(
+        *(balance(api) for api in clients), return_exceptions=True
+    )
+    balances, failed = {}, {}
+    for api, result in zip(clients, results):
+        balances[api] = 0
+        if isinstance(result, asyncio.TimeoutError):
+            failed[api] = f"timeout after {BALANCE_TIMEOUT} seconds"
+        elif isinstance(result, Exception):
+            failed[api] = exception_handler(result)
+        else:
+            balances[api] = result
+    print("bittrex balances:", balances)
+    if failed:
+        print(it("red", "bittrex balances failed:"), failed, line_info())
+    return balances, failed
+
+
+# ASYNC RPC BLOCKS
+async def aio_get_blocks(bitshares, block_first, block_last):
+    """
+    fetch blocks AIO_RPC_WINDOW at a time, fetching the next window
+    while the blocks of this one are checked
+    :param int(block_first): first block number to fetch
+    :param int(block_last): last block number to fetch
+    :yield tuple(int(block_num), dict(block)): in block order
+    """
+    windows = [
+        range(start, min(start + AIO_RPC_WINDOW, block_last + 1))
+        for start in range(block_first, block_last + 1, AIO_RPC_WINDOW)
+    ]
+
+    def fetch(window):
+        return asyncio.ensure_future(
+            asyncio.gather(*(bitshares.rpc.get_block(num) for num in window))
+        )
+
+    pending = fetch(windows[0]) if windows else None
+    for idx, window in enumerate(windows):
+        blocks = await pending
+        if idx + 1 < len(windows):
+            pending = fetch(windows[idx + 1])
+        for block_num, block in zip(window, blocks):
+            yield block_num, block
+
+
+# LISTENER TASKS
+async def aio_listener_bitshares(keys):
+    """
+    listener_bitshares() on the event loop, blocks are fetched over one websocket
+    and checked by check_block() on a worker thread
+    :param dict(keys): bittrex api keys and pybitshares wallet password
+    """
+    if INGEST == "history":
+        # account history paging has no async counterpart, keep it on a thread
+        await to_thread(listener_bitshares, keys)
+        return
+    bitshares = None
+    while True:
+        try:
+            if bitshares is None:
+                bitshares = BitShares(node=NODE)
+                await bitshares.connect()
+            block_last = await to_thread(get_block_num_database)
+            # cached by the rpc block height tracker, no round trip per iteration
+            block_new = await to_thread(get_block_num_current)
+            begin = time.time()
+            async for block_num, block in aio_get_blocks(
+                bitshares, block_last + 1, block_new
+            ):
+                if block_num % 20 == 0:
+                    rate = round((block_num - block_last) / (time.time() - begin), 1)
+                    log("INFO", "blocks", block_num=block_num, rate=rate)
+                # SECURITY - checkpoint immediately after serving any transfer
+                served = await to_thread(check_block, block_num, block, keys)
+                if served or block_num % BLOCK_CHECKPOINT == 0:
+                    await to_thread(set_block_num_database, block_num)
+            if block_new > block_last:
+                await to_thread(set_block_num_database, block_new)
+        except Exception as error:
+            print(exception_handler(error), line_info())
+            # reconnect on the next iteration
+            bitshares = None
+        await asyncio.sleep(30)
+
+
+async def aio_listener_sql():
+    """
+    listener_sql() on the event loop, sleeps until the next payment is due
+    """
+    await to_thread(schedule_load)
+    while True:
+        now = await to_thread(schedule_wait)
+        await to_thread(payments_process, now)
+
+
+async def aio_listener_balances(keys):
+    """
+    about every 2 hours update receipts table with current account balances
+    :param dict(keys): bittrex api keys
+    """
+    header = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+    async with aiohttp.ClientSession(headers=header) as session:
+        clients = {
+            api: AioBittrex(keys[f"api_{api}_key"], keys[f"api_{api}_secret"], session)
+            for api in range(1, 4)
+        }
+        while True:
+            force = True
+            if not DEV:
+                balance_bittrex_store(*await aio_balance_bittrex(clients))
+                force = False
+            await to_thread(balances_report, keys, force)
+            await asyncio.sleep(7195)
+
+
+async def aio_supervise(task, *args):
+    """
+    run a listener task forever, restarting it with backoff whenever it raises,
+    so one failing listener never ends the others
+    :param coroutine function(task): a listener task
+    """
+    pause = 0
+    while True:
+        begin = time.time()
+        try:
+            await task(*args)
+        except Exception as error:
+            print(exception_handler(error), line_info())
+            log("ERROR", "listener task restarting", task=task.__name__)
+        # a task which ran a while before failing starts its backoff over
+        if time.time() - begin > AIO_BACKOFF:
+            pause = 0
+        await asyncio.sleep(min(2 ** pause, AIO_BACKOFF))
+        pause += 1
+
+
+async def aio_main(keys):
+    """
+    run the listeners as tasks on one event loop, each supervised separately
+    :param dict(keys): bittrex api keys and pybitshares wallet password
+    """
+    await asyncio.gather(
+        aio_supervise(aio_listener_bitshares, keys),
+        aio_supervise(aio_listener_sql),
+        aio_supervise(aio_listener_balances, keys),
+    )
+
+
+def main():
+    """
+    login then run the listeners on the asyncio runtime
+    """
+    keys = login()
+    migrate()
+    welcome(keys)
+    withdrawals_reconcile(keys)
+    metrics_start()
+    # pybitshares signs synchronously, payouts stay on the bounded worker pool
+    payment_workers(payment_child, keys)
+    asyncio.run(aio_main(keys))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+BitShares.org StakeMachine
+End to End Benchmarks with Recorded Baselines
+run from the repository root:
+    python3.8 -m benchmarks run
+    python3.8 -m benchmarks compare
+BitShares Management Group Co. Ltd.
+"""
@@ -0,0 +1,70 @@
+"""
+BitShares.org StakeMachine
+Benchmark Command Line
+    python3.8 -m benchmarks run [--quick] [--only ingest burst ...] [--out FILE]
+    python3.8 -m benchmarks baseline [FILE]
+    python3.8 -m benchmarks compare [FILE] [--baseline FILE] [--tolerance 0.1]
+compare exits 1 when any metric regressed by more than the tolerance
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=import-outside-toplevel
+
+# STANDARD PYTHON MODULES
+import os
+import shutil
+import sys
+from argparse import ArgumentParser
+
+# STAKE BTS MODULES
+from benchmarks.harness import (BASELINE, RESULTS, TOLERANCE, compare, load,
+                                run, save, setup)
+
+
+def main():
+    """
+    run the scenarios, record a baseline, or compare results to the baseline
+    """
+    parser = ArgumentParser(prog="python3.8 -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("run", help="run scenarios and write results")
+    command.add_argument("--quick", action="store_true", help="smaller sizes")
+    command.add_argument("--only", nargs="+", default=[], help="scenario prefixes")
+    command.add_argument("--out", default=RESULTS)
+    command = commands.add_parser("baseline", help="store results as the baseline")
+    command.add_argument("results", nargs="?", default=RESULTS)
+    command = commands.add_parser("compare", help="flag regressions vs the baseline")
+    command.add_argument("results", nargs="?", default=RESULTS)
+    command.add_argument("--baseline", default=BASELINE)
+    command.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if args.command != "run" and not os.path.exists(args.results):
+        print(f"no results recorded at {args.results}, run `run` first")
+        return
+    if args.command == "run":
+        # config must point at the benchmark environment before scenarios import
+        setup()
+        from benchmarks.scenarios import scenario_sizes, scenarios
+
+        selected = {
+            name: scenario
+            for name, scenario in scenarios(args.quick).items()
+            if not args.only or name.startswith(tuple(args.only))
+        }
+        params = {"quick": args.quick, "only": args.only}
+        save(run(selected, {**params, **scenario_sizes(args.quick)}), args.out)
+    elif args.command == "baseline":
+        shutil.copyfile(args.results, BASELINE)
+        print(f"{args.results} stored as the baseline {BASELINE}")
+    elif not os.path.exists(args.baseline):
+        print(f"no baseline recorded at {args.baseline}, run `baseline` first")
+    else:
+        regressions = compare(load(args.results), load(args.baseline), args.tolerance)
+        print(f"\n{len(regressions)} regressions beyond {100 * args.tolerance:g}%")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
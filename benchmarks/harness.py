@@ -0,0 +1,263 @@
+"""
+BitShares.org StakeMachine
+Benchmark Environment, Timing, Results and Baseline Comparison
+every run uses a fresh temporary database and an in process fake_node.py
+in DEV mode, so nothing is ever broadcast and bittrex is never called
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=import-outside-toplevel
+
+# STANDARD PYTHON MODULES
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from threading import Thread
+
+# STAKE BTS MODULES
+import config
+
+# environment shared by all scenarios, built once per run by setup()
+BENCH = {"dir": None, "keys": None, "workers": False}
+PATH = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(PATH, "results.json")
+BASELINE = os.path.join(PATH, "baseline.json")
+TOLERANCE = 0.1  # relative change in a metric which is flagged as a regression
+
+
+def setup():
+    """
+    point config at a temporary database and the in process fake node,
+    this must run before any other stake bts module is imported
+    :return dict(keys): DEV login keys, as login() returns them
+    """
+    if BENCH["keys"] is not None:
+        return BENCH["keys"]
+    BENCH["dir"] = tempfile.mkdtemp(prefix="stake_bench_")
+    config.DB = os.path.join(BENCH["dir"], "stake_bitshares.db")
+    config.LOG_FILE = os.path.join(BENCH["dir"], "stake_bitshares.log")
+    config.LOG_COLOR = False
+    config.LOG_LEVEL = "WARN"
+    config.METRICS_PORT = 0
+    config.DEV = True  # transfers and bittrex withdrawals are skipped
+    config.NODE = "ws://127.0.0.1:8090"  # fake_node.FAKE_NODE_PORT
+    import fake_node
+
+    fake_node.BLOCK_SECONDS = 0  # a fixed head block, runs are repeatable
+    Thread(target=asyncio.run, args=(fake_node.main_async(),), daemon=True).start()
+    time.sleep(1)
+    database_create()
+    signer_install()
+    BENCH["keys"] = {
+        "broker": config.BROKER,
+        "password": "",
+        "api_1_key": "",
+        "api_1_secret": "",
+        "api_2_key": "",
+        "api_2_secret": "",
+        "api_3_key": "",
+        "api_3_secret": "",
+    }
+    return BENCH["keys"]
+
+
+def database_create():
+    """
+    create the temporary database with the current schema, as db_setup.py does
+    :return None:
+    """
+    from db_migrate import migrate
+    from db_setup import SCHEMA
+    from fake_node import BLOCK_START
+    from utilities import sql_db
+
+    queries = [{"query": query, "values": ()} for query in SCHEMA]
+    query = "INSERT INTO block_num (block_num) VALUES (?)"
+    queries.append({"query": query, "values": (BLOCK_START,)})
+    sql_db(queries)
+    migrate()
+
+
+def signer_install():
+    """
+    load the fake broker's keys into the in memory signer rather than a wallet
+    :return None:
+    """
+    from bitshares.bitshares import BitShares
+    from bitshares.memo import Memo
+
+    from fake_node import test_key
+    from rpc import SIGNER
+
+    wifs = [str(test_key(config.BROKER))]
+    signer = BitShares(node=config.NODE, keys=wifs, nobroadcast=True)
+    SIGNER.update({"bitshares": signer, "memo": Memo(blockchain_instance=signer)})
+
+
+def database_reset():
+    """
+    empty the tables scenarios write to, and the in memory queues which mirror them
+    :return None:
+    """
+    from payment_queue import PAYMENTS
+    from receipt_journal import journal_flush
+    from scheduler import SCHEDULE
+    from utilities import sql_db
+
+    journal_flush()
+    sql_db(
+        [
+            {"query": f"DELETE FROM {table}", "values": ()}
+            for table in ("stakes", "payments", "receipts")
+        ]
+    )
+    with PAYMENTS["condition"]:
+        PAYMENTS["queue"].clear()
+        PAYMENTS["ids"].clear()
+        PAYMENTS["running"].clear()
+        PAYMENTS["parked"].clear()
+        PAYMENTS["resumed"].clear()
+    with SCHEDULE["condition"]:
+        SCHEDULE["heap"] = []
+
+
+def percentile(samples, share):
+    """
+    :param list(samples): latencies in seconds
+    :param float(share): eg. 0.99
+    :return float(): the sample at that share of the sorted samples, in ms
+    """
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return round(1000 * samples[min(int(share * len(samples)), len(samples) - 1)], 3)
+
+
+def run(scenarios, params=None):
+    """
+    :param dict(scenarios): {name: callable(keys) returning dict(metrics)}
+    :param dict(params): scenario sizes and options, recorded with the results
+    :return dict(): results with the environment they were measured in
+    """
+    keys = setup()
+    results = {}
+    for name, scenario in scenarios.items():
+        print(f"\n{name}")
+        database_reset()
+        for metric, value in scenario(keys).items():
+            results[f"{name}.{metric}"] = value
+            print(f"    {metric:<32}{value}")
+    return {"meta": meta(params or {}), "results": results}
+
+
+def processor():
+    """
+    :return str(): cpu model name, platform.processor() is often empty on linux
+    """
+    try:
+        with open("/proc/cpuinfo") as handle:
+            for line in handle:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def meta(params):
+    """
+    :param dict(params): scenario sizes and options
+    :return dict(): when, where, with what and at which commit results were measured
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:  # pylint: disable=broad-except
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": processor(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "config": {
+            name: getattr(config, name)
+            for name in (
+                "PAYMENT_WORKERS",
+                "PAYOUT_BATCH_WINDOW",
+                "PAYOUT_BATCH_SIZE",
+                "MEMO_REPLAY",
+                "MEMO_BATCH",
+                "RECEIPT_BATCH",
+                "RECEIPT_FLUSH",
+            )
+        },
+    }
+
+
+def save(results, path):
+    """
+    :param dict(results): from run()
+    :param str(path): json file to write
+    :return None:
+    """
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+    print(f"\nresults written to {path}")
+
+
+def load(path):
+    """
+    :param str(path): json file written by save()
+    :return dict(): results
+    """
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def lower_is_better(metric):
+    """
+    :param str(metric): eg. "writers_8.write_p99_ms"
+    :return bool(): latencies, durations and errors regress upward, rates downward
+    """
+    return metric.endswith(("_ms", "seconds", "errors"))
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    compare each metric in results to the same metric in the baseline
+    :param dict(results): from run()
+    :param dict(baseline): from an earlier run()
+    :param float(tolerance): relative change flagged as a regression
+    :return list(str()): regressed metrics
+    """
+    regressions = []
+    print(f"baseline {baseline['meta']['commit']} at {baseline['meta']['time']}")
+    print(f"results  {results['meta']['commit']} at {results['meta']['time']}\n")
+    for metric, value in sorted(results["results"].items()):
+        before = baseline["results"].get(metric)
+        if before is None:
+            print(f"{metric:<48}{value:>14}    new")
+            continue
+        if before:
+            change = (value - before) / abs(before)
+            shown = f"{100 * change:+.1f}%"
+        else:
+            change = float(value > 0)
+            shown = "was 0"
+        worse = change > tolerance if lower_is_better(metric) else -change > tolerance
+        print(f"{metric:<48}{value:>14}{shown:>10}  {'REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(metric)
+    return regressions
@@ -0,0 +1,259 @@
+"""
+BitShares.org StakeMachine
+Benchmark Scenarios
+each scenario returns a dict of metrics; names ending _per_s are rates,
+_ms and seconds are latencies, errors are counts which should stay at zero
+import only after harness.setup() has pointed config at the benchmark environment
+BitShares Management Group Co. Ltd.
+"""
+
+# STANDARD PYTHON MODULES
+import time
+from functools import partial
+from random import Random
+from threading import Thread
+
+# STAKE BTS MODULES
+import fake_node
+from benchmarks.harness import BENCH, percentile
+from config import MEMO_REPLAY
+from payment_queue import payment_stats, payment_workers
+from receipt_journal import journal_flush
+from rpc import get_blocks
+from stake_bitshares import (MUNIX_MONTH, NINES, check_block,
+                             get_block_num_database, memo_prefetch,
+                             payment_child, payments_process,
+                             set_block_num_database, stake_start)
+from utilities import munix, sql_db
+
+# USER DEFINED CONSTANTS
+DENSITIES = (0, 0.05, 0.5, 2)  # broker transfers per block
+INGEST_BLOCKS = 2000  # blocks ingested at each density
+STAKES = 2000  # twelve month stakes started, 15 stakes rows each
+STAKE_ROWS = (10000, 100000, 1000000)  # stakes table sizes scanned by listener_sql
+DUE = 0.01  # share of the stakes rows which are due at month end
+BURSTS = (100, 1000)  # simultaneous payouts due at month end
+WRITERS = (1, 8, 64)  # concurrent sql_db threads, as db_abuse.py
+WRITER_OPS = 200  # block number gets and sets by each thread
+QUICK = {"INGEST_BLOCKS": 500, "STAKES": 500, "STAKE_ROWS": (10000, 100000)}
+
+
+def ingest(keys, density, blocks):
+    """
+    block ingestion as listener_bitshares() catches up, including memo decryption
+    and serving every transfer to the broker
+    """
+    fake_node.DENSITY = density
+    first = fake_node.BLOCK_START + 1
+    last = first + blocks - 1
+    served = 0
+    begin = time.time()
+    source = get_blocks(first, last)
+    if blocks > MEMO_REPLAY:
+        source = memo_prefetch(source, keys)
+    else:
+        source = ((block_num, block, None) for block_num, block in source)
+    for block_num, block, memos in source:
+        served += check_block(block_num, block, keys, memos)
+    journal_flush()
+    elapsed = time.time() - begin
+    ret = {"blocks_per_s": round(blocks / elapsed, 1)}
+    if density:
+        ret["transfers_per_s"] = round(served / elapsed, 1)
+    return ret
+
+
+def stake_inserts(_, stakes):
+    """
+    stake_start() without receipts, as import_data.py adds existing contracts
+    """
+    nonce = munix()
+    begin = time.time()
+    for idx in range(stakes):
+        params = {
+            "nonce": nonce + idx,
+            "block_num": fake_node.BLOCK_START,
+            "client": f"client{idx}",
+            "amount": 25000,
+            "months": 12,
+        }
+        stake_start(params)
+    elapsed = time.time() - begin
+    return {
+        "stakes_per_s": round(stakes / elapsed, 1),
+        "rows_per_s": round(15 * stakes / elapsed, 1),
+    }
+
+
+def stakes_seed(rows, due, now):
+    """
+    fill the stakes table with pending principal, penalty and interest rows
+    :param int(rows): total rows
+    :param int(due): every due'th row is due before now, the rest next month
+    :param int(now): munix timestamp
+    :return int(): principal and interest payments due
+    """
+    payments = 0
+    query = (
+        "INSERT INTO stakes "
+        + "(client, token, amount, type, start, due, processed, status, "
+        + "block_start, block_processed, number) "
+        + "VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+    )
+    for chunk in range(0, rows, 100000):
+        values = []
+        for idx in range(chunk, min(chunk + 100000, rows)):
+            payment = ("penalty", "principal", "interest")[min(idx % 15, 2)]
+            is_due = idx % due == 0
+            payments += is_due and payment != "penalty"
+            values.append(
+                (
+                    f"client{idx % 10000}",
+                    "BTS",
+                    -3750 if payment == "penalty" else 25000,
+                    payment,
+                    idx,
+                    now - 1 if is_due else now + MUNIX_MONTH,
+                    0,
+                    "pending",
+                    fake_node.BLOCK_START,
+                    NINES,
+                    idx,
+                )
+            )
+        sql_db([{"query": query, "values": values, "many": True}])
+    return payments
+
+
+def listener_scan(_, rows):
+    """
+    one listener_sql() wake at month end: scan the stakes table, mark payments due
+    processing and penalties aborted, then dispatch each to the payment queue
+    """
+    now = munix()
+    payments = stakes_seed(rows, int(1 / DUE), now)
+    begin = time.time()
+    payments_process(now)
+    elapsed = time.time() - begin
+    return {
+        "seconds": round(elapsed, 3),
+        "payments_per_s": round(payments / elapsed, 1),
+    }
+
+
+def burst(keys, payouts):
+    """
+    month end burst, every payout due at once, from listener_sql() wake until each
+    is paid by the payment_workers() pool
+    """
+    if not BENCH["workers"]:
+        payment_workers(payment_child, keys)
+        BENCH["workers"] = True
+    now = munix()
+    # one interest payment due per client, so no client's payouts are serialized
+    query = (
+        "INSERT INTO stakes "
+        + "(client, token, amount, type, start, due, processed, status, "
+        + "block_start, block_processed, number) "
+        + "VALUES (?,'BTS',2000,'interest',?,?,0,'pending',?,?,1)"
+    )
+    values = [
+        (f"client{idx}", now - MUNIX_MONTH, now - 1, fake_node.BLOCK_START, NINES)
+        for idx in range(payouts)
+    ]
+    sql_db([{"query": query, "values": values, "many": True}])
+    done = payment_stats()["done"]
+    begin = time.time()
+    payments_process(now)
+    while payment_stats()["done"] - done < payouts:
+        time.sleep(0.01)
+    elapsed = time.time() - begin
+    query = "SELECT started - queued, finished - queued FROM payments"
+    latencies = sql_db(query)
+    waits = [i[0] / 1000 for i in latencies]
+    totals = [i[1] / 1000 for i in latencies]
+    return {
+        "seconds": round(elapsed, 3),
+        "payouts_per_s": round(payouts / elapsed, 1),
+        "queue_wait_p50_ms": percentile(waits, 0.5),
+        "queue_wait_p99_ms": percentile(waits, 0.99),
+        "payout_p50_ms": percentile(totals, 0.5),
+        "payout_p99_ms": percentile(totals, 0.99),
+    }
+
+
+def writers(_, threads):
+    """
+    concurrent threads getting and setting the block number, as db_abuse.py,
+    reads share per thread connections, writes queue to the single writer
+    """
+    samples = {"read": [], "write": [], "errors": []}
+
+    def abuse(seed):
+        rng = Random(seed)
+        for _ in range(WRITER_OPS):
+            begin = time.time()
+            try:
+                if rng.random() > 0.5:
+                    set_block_num_database(fake_node.BLOCK_START + rng.randint(0, 999))
+                    samples["write"].append(time.time() - begin)
+                else:
+                    get_block_num_database()
+                    samples["read"].append(time.time() - begin)
+            except Exception as error:  # pylint: disable=broad-except
+                samples["errors"].append(error)
+
+    workers = [Thread(target=abuse, args=(seed,)) for seed in range(threads)]
+    begin = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - begin
+    set_block_num_database(fake_node.BLOCK_START)
+    return {
+        "ops_per_s": round(threads * WRITER_OPS / elapsed, 1),
+        "read_p50_ms": percentile(samples["read"], 0.5),
+        "read_p99_ms": percentile(samples["read"], 0.99),
+        "write_p50_ms": percentile(samples["write"], 0.5),
+        "write_p99_ms": percentile(samples["write"], 0.99),
+        "errors": len(samples["errors"]),
+    }
+
+
+def scenario_sizes(quick=False):
+    """
+    :param bool(quick): smaller sizes, for a fast check rather than a baseline
+    :return dict(): the sizes each scenario runs at
+    """
+    return {
+        "DENSITIES": DENSITIES,
+        "INGEST_BLOCKS": INGEST_BLOCKS,
+        "STAKES": STAKES,
+        "STAKE_ROWS": STAKE_ROWS,
+        "BURSTS": BURSTS,
+        "WRITERS": WRITERS,
+        "WRITER_OPS": WRITER_OPS,
+        **(QUICK if quick else {}),
+    }
+
+
+def scenarios(quick=False):
+    """
+    :param bool(quick): smaller sizes, for a fast check rather than a baseline
+    :return dict(): {name: callable(keys)} in the order they run
+    """
+    sizes = scenario_sizes(quick)
+    ret = {}
+    for density in DENSITIES:
+        ret[f"ingest_{100 * density:g}_per_100_blocks"] = partial(
+            ingest, density=density, blocks=sizes["INGEST_BLOCKS"]
+        )
+    ret["stake_start"] = partial(stake_inserts, stakes=sizes["STAKES"])
+    for rows in sizes["STAKE_ROWS"]:
+        ret[f"listener_sql_{rows}"] = partial(listener_scan, rows=rows)
+    for payouts in BURSTS:
+        ret[f"burst_{payouts}"] = partial(burst, payouts=payouts)
+    for threads in WRITERS:
+        ret[f"writers_{threads}"] = partial(writers, threads=threads)
+    return ret
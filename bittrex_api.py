@@ -7,7 +7,9 @@ Consulted:
     https://github.com/DevSecNinja/aiobittrexapi/blob/main/aiobittrexapi/utils.py
 Added:
     post_withdrawal()
+    get_withdrawal_by_client_id()
     unit_test()
+    persistent keep alive session with retry/backoff and timeouts
 Passes:
     pylint/black/isort/sourcery
 wtfpl litepresence2021
@@ -22,10 +24,18 @@ from urllib.parse import urlencode
 
 # THIRD PARTY MODULES
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-API_URL = "https://api.bittrex.com/v3/"
+# STAKE BTS MODULES
+from config import BITTREX_API_URL
+from logger import log
+
+API_URL = BITTREX_API_URL  # eg. a local mock_bittrex.py for benchmarking
 API_KEY = ""  # only for unit testing
 API_SECRET = ""  # only for unit testing
+TIMEOUT = (5, 30)  # seconds to connect, seconds to read
+RETRIES = 3  # retries of idempotent requests on connection errors and 429/5xx
 
 
 def _session():
@@ -33,7 +43,17 @@ def _session():
         "Content-Type": "application/json",
         "Accept": "application/json",
     }
+    # POST is not retried by default, so a withdrawal is never sent twice
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
     session = requests.sessions.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     session.headers.update(header)
     return session
 
@@ -41,21 +61,31 @@ def _session():
 class Bittrex:
     """
     Client for Bittrex for V3 API
+    each instance holds a persistent, thread safe, keep alive connection pool
     """
 
     def __init__(self, api_key, api_secret):
         self.response = ""
         self.api_key = api_key
         self.api_secret = api_secret
+        self.session = _session()
+
+    def close(self):
+        """
+        close the pooled connections of this client
+        """
+        self.session.close()
 
     def _request(self, method, endpoint, **kwargs):
         uri = API_URL + endpoint
-        with _session() as session:
-            self.response = getattr(session, method)(uri, **kwargs)
+        kwargs.setdefault("timeout", TIMEOUT)
+        self.response = getattr(self.session, method)(uri, **kwargs)
         return self.response.json()
 
-    def _authenticated_request(self, method, endpoint, **kwargs):
-
+    def _sign(self, method, endpoint, kwargs):
+        """
+        :return tuple(str(uri), dict(headers), dict(request_data)): signed request
+        """
         request_data = {}
         payload = ""
         if len(kwargs) > 0:
@@ -70,24 +100,22 @@ class Bittrex:
         signature = hmac.new(
             self.api_secret.encode(), _pre_sign.encode(), hashlib.sha512
         ).hexdigest()
-        with _session() as session:
-            session.headers.update(
-                {
-                    "Api-Key": self.api_key,
-                    "Api-Timestamp": mill_timestamp,
-                    "Api-Content-Hash": content_hash,
-                    "Api-Signature": signature,
-                }
-            )
-            print(
-                {
-                    "uri": uri,
-                    "headers": session.headers,
-                    "method": method,
-                    "data": request_data,
-                }
-            )
-            self.response = getattr(session, method)(uri, **request_data)
+        # per request headers, the shared session may serve several threads
+        headers = {
+            "Api-Key": self.api_key,
+            "Api-Timestamp": mill_timestamp,
+            "Api-Content-Hash": content_hash,
+            "Api-Signature": signature,
+        }
+        return uri, headers, request_data
+
+    def _authenticated_request(self, method, endpoint, **kwargs):
+        uri, headers, request_data = self._sign(method, endpoint, kwargs)
+        # api key and signature headers are redacted
+        log("DEBUG", "bittrex", uri=uri, headers=headers, method=method)
+        self.response = getattr(self.session, method)(
+            uri, headers=headers, timeout=TIMEOUT, **request_data
+        )
         return self.response.json()
 
     def get_balances(self):
@@ -221,6 +249,27 @@ class Bittrex:
         """
         return self._authenticated_request("get", "withdrawals/closed", **params)
 
+    def get_withdrawal_by_client_id(self, client_withdrawal_id):
+        """
+        https://api.bittrex.com/v3/withdrawals/ByClientWithdrawalId/{id}
+        @param client_withdrawal_id str(uuid) sent with the withdrawal
+        :return:
+        {
+          "id": "string (uuid)",
+          "currencySymbol": "string",
+          "quantity": "number (double)",
+          "cryptoAddress": "string",
+          "txId": "string",
+          "status": "string",
+          "createdAt": "string (date-time)",
+          "completedAt": "string (date-time)",
+          "clientWithdrawalId": "string (uuid)"
+        }
+        """
+        return self._authenticated_request(
+            "get", "withdrawals/ByClientWithdrawalId/" + client_withdrawal_id
+        )
+
     def get_addresses(self):
         """
         List deposit addresses that have been requested or provisioned
@@ -6,7 +6,13 @@ BitShares Management Group Co. Ltd.
 
 # USER DEFINED CONSTANTS
 DB = "database/stake_bitshares.db"
+DB_TIMEOUT = 5  # seconds sqlite waits on a locked database before raising
+DB_CACHE = 16000  # KiB of page cache per sqlite connection
 NODE = "wss://api.bts.mobi"
+BITTREX_API_URL = "https://api.bittrex.com/v3/"  # mock: "http://127.0.0.1:8091/v3/"
+NODE_POOL_SIZE = 12  # maximum idle pybitshares connections kept open for reuse
+NODE_HEALTH_CHECK = 60  # seconds idle before a pooled connection is pinged on reuse
+SIGNER_IDLE = 900  # seconds idle before the in memory signing keys are wiped
 EMAIL = "complaints@stakebts.bitsharesmanagement.group"
 BROKER = "bitsharesmanagement.group"
 MANAGERS = ["dls.cipher", "escrow.zavod.premik"]
@@ -32,6 +38,58 @@ INVEST_AMOUNTS = [
 # False : start from current block number
 # int() : start from user specified block number
 REPLAY = False
+# BALANCES #
+BALANCE_TIMEOUT = 10  # seconds to wait on each bittrex account balance
+BALANCE_TTL = 30  # seconds a cached balance is trusted before it is fetched again
+# OBJECT CACHES #
+ACCOUNT_CACHE_SIZE = 10000  # most recently used account lookups kept in memory
+ACCOUNT_CACHE_TTL = 3600  # seconds before a cached account, eg. its LTM status, expires
+ASSET_CACHE_TTL = 86400  # seconds before a cached asset precision expires
+# PAYMENTS #
+PAYMENT_WORKERS = 32  # maximum payouts in flight, and so transfers per batch window
+PAYMENT_POLL = 60  # seconds between checks for payments queued by other processes
+PAYOUT_BATCH_WINDOW = 2  # seconds to gather payouts into one transaction, 0 disables
+PAYOUT_BATCH_SIZE = 32  # transfers per transaction, sent when full, <= PAYMENT_WORKERS
+# TREASURY #
+TREASURY_POLL = 120  # seconds between treasury checks for arrived cover funds
+COVER_TIMEOUT = 43200  # seconds a payout waits on cover funds before it fails
+# WITHDRAWALS #
+WITHDRAWAL_POLL = 15  # seconds between bulk status checks of open bittrex withdrawals
+WITHDRAWAL_PAGES = 5  # closed withdrawal pages searched per check, 200 per page
+WITHDRAWAL_SETTLE = 30  # seconds a completed withdrawal is still counted in transit
+WITHDRAWAL_EXPIRE = 86400  # seconds before a withdrawal never seen closing is dropped
+WITHDRAWAL_RETRIES = 3  # resends of a withdrawal, same clientWithdrawalId, on errors
+# RECEIPTS #
+RECEIPT_FLUSH = 0.05  # seconds receipts are buffered before a group commit
+RECEIPT_BATCH = 500  # receipts waiting which trigger a group commit at once
+# METRICS #
+METRICS_HOST = "127.0.0.1"  # local interface serving http://host:port/metrics
+METRICS_PORT = 9109  # 0 disables the metrics endpoint
+# LOGGING #
+LOG_FILE = "stake_bitshares.log"  # structured json lines, one record per line
+LOG_LEVEL = "INFO"  # DEBUG, INFO, WARN, or ERROR; DEBUG logs every sql query
+LOG_COLOR = True  # also print each record to the terminal in color
+LOG_QUEUE = 100000  # records buffered for the log writer before records are dropped
+# SCHEDULER #
+SCHEDULE_RESYNC = 600  # seconds between schedule rebuilds, picks up manual db edits
+# INGEST #
+# "blocks" : scan every block for transfers to the broker
+# "history" : page through the broker's account history for transfers to the broker
+INGEST = "blocks"
+HISTORY_PAGE = 100  # account history operations per request, node maximum is 100
+# ASYNCIO RUNTIME #
+AIO_RPC_WINDOW = 100  # blocks fetched concurrently by aio_runtime.py on one websocket
+AIO_BACKOFF = 300  # maximum seconds before a failed listener task restarts
+# MEMO DECRYPTION #
+MEMO_REPLAY = 1000  # blocks behind head before memos are decrypted on a process pool
+MEMO_BATCH = 1000  # blocks whose broker transfer memos are decrypted at once
+MEMO_WORKERS = 0  # memo decryption processes, 0 for one per cpu core
+# BLOCK HEIGHT #
+BLOCK_INTERVAL = 3  # seconds between block height polls, the chain's block interval
+HEIGHT_STALE = 30  # seconds before a cached block height is fetched directly
+# BLOCK CATCH UP #
+BLOCK_WINDOW = 10  # maximum blocks fetched concurrently ahead of check_block()
+BLOCK_CHECKPOINT = 100  # blocks without broker transfers between database checkpoints
 # UNIT TESTING MODE
 DEV = False
 ADMIN_REPLAY = False
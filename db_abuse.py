@@ -32,8 +32,8 @@ def main():
     spin off several threads to induce SQL race condition
     """
     print("\033c")
-    print("you should see occassional OperationalError")
-    print("but get and set should continue\n")
+    print("reads share per thread connections, writes queue to a single writer")
+    print("OperationalError should be rare, but get and set should continue\n")
     input("press Enter to begin\n")
     threads = {}
     for i in range(100):
@@ -0,0 +1,110 @@
+"""
+BitShares.org StakeMachine
+Unit Test that every hot query is served by an index rather than a table scan
+BitShares Management Group Co. Ltd.
+"""
+
+# STANDARD PYTHON MODULES
+from sqlite3 import connect as sql
+
+# STAKE BTS MODULES
+from db_migrate import MIGRATIONS
+from db_setup import SCHEMA
+from utilities import it
+
+# query text as issued by stake_bitshares.py, manual_payouts.py and audits
+HOT_QUERIES = {
+    "listener_sql payments due": (
+        "SELECT amount, client, start, number, type FROM stakes "
+        + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'",
+        (0,),
+    ),
+    "listener_sql closed contracts": (
+        "SELECT amount, client, start, number FROM stakes "
+        + "WHERE type='penalty' AND due<? AND status='pending'",
+        (0,),
+    ),
+    "listener_sql mark processing": (
+        "UPDATE stakes "
+        + "SET status='processing', block_processed=?, processed=? "
+        + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'",
+        (0, 0, 0),
+    ),
+    "listener_sql abort penalties": (
+        "UPDATE stakes "
+        + "SET status='aborted', block_processed=?, processed=? "
+        + "WHERE type='penalty' AND due<? AND status='pending'",
+        (0, 0, 0),
+    ),
+    "listener_balances due today": (
+        "SELECT amount FROM stakes "
+        + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'",
+        (0,),
+    ),
+    "stake_stop amounts due": (
+        "SELECT amount FROM stakes "
+        + "WHERE client=? AND status='pending' "
+        + "AND (type='principal' OR type='penalty')",
+        ("",),
+    ),
+    "stake_stop premature principal": (
+        "UPDATE stakes "
+        + "SET status='premature', processed=?, block_processed=? "
+        + "WHERE client=? AND status='pending' AND type='principal'",
+        (0, 0, ""),
+    ),
+    "stake_paid": (
+        "UPDATE stakes "
+        + "SET status='paid', block_processed=?, processed=? "
+        + "WHERE client=? AND start=? AND number=? AND status='processing' AND "
+        + "(type='interest' OR type='principal')",
+        (0, 0, "", 0, 0),
+    ),
+    "payment_load queued": (
+        "SELECT id, client, params, queued FROM payments "
+        + "WHERE status='queued' ORDER BY id",
+        (),
+    ),
+    "payment_workers interrupted": (
+        "SELECT id, params FROM payments WHERE status='running'",
+        (),
+    ),
+    "receipts audit": (
+        "SELECT now, msg FROM receipts WHERE nonce=? ORDER BY now",
+        (0,),
+    ),
+}
+
+
+def explain(con, query, values):
+    """
+    :return list(): the detail column of each EXPLAIN QUERY PLAN row
+    """
+    return [row[-1] for row in con.execute("EXPLAIN QUERY PLAN " + query, values)]
+
+
+def main():
+    """
+    build the latest schema in memory and assert no hot query scans a table
+    """
+    con = sql(":memory:")
+    for query in SCHEMA:
+        con.execute(query)
+    for migration in MIGRATIONS:
+        for query in migration:
+            con.execute(query)
+    failed = []
+    for name, (query, values) in HOT_QUERIES.items():
+        plan = explain(con, query, values)
+        scans = [i for i in plan if i.startswith("SCAN") or "TEMP B-TREE" in i]
+        print(it("red" if scans else "green", name), plan)
+        if scans:
+            failed.append(name)
+    con.close()
+    if failed:
+        raise AssertionError(f"hot queries without index: {failed}")
+    print(it("green", "\nall hot queries use an index"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+BitShares.org StakeMachine
+Versioned Schema Migrations to Upgrade an Existing Database in Place
+BitShares Management Group Co. Ltd.
+"""
+
+# STAKE BTS MODULES
+from utilities import it, sql_db
+
+# each migration is a batch of queries applied atomically and in order
+# the database PRAGMA user_version counts the migrations already applied
+MIGRATIONS = [
+    # 1) indexes for listener_sql, stake_stop, stake_paid and receipt audits
+    [
+        # pending payments by due time, covering the listener_sql SELECT columns
+        "CREATE INDEX IF NOT EXISTS stakes_pending_due ON stakes "
+        + "(due, type, amount, client, start, number, status) WHERE status='pending'",
+        # a client's payments by status, for stake_stop and stake_paid
+        "CREATE INDEX IF NOT EXISTS stakes_client_status ON stakes "
+        + "(client, status, type, start, number)",
+        # audit trail of a stake
+        "CREATE INDEX IF NOT EXISTS receipts_nonce ON receipts (nonce, now)",
+    ],
+    # 2) persistent payment queue served by payment_queue.py workers
+    [
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client TEXT,
+            params TEXT,
+            status TEXT,
+            queued INTEGER,
+            started INTEGER,
+            finished INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS payments_status ON payments (status, id)",
+    ],
+    # 3) ledger of bittrex withdrawals, written before each is sent
+    [
+        """
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id TEXT PRIMARY KEY,
+            key TEXT,
+            attempt INTEGER,
+            api INTEGER,
+            client TEXT,
+            amount INTEGER,
+            status TEXT,
+            withdrawal_id TEXT,
+            created INTEGER,
+            updated INTEGER,
+            response TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS withdrawals_key ON withdrawals (key, attempt)",
+        "CREATE INDEX IF NOT EXISTS withdrawals_status ON withdrawals (status)",
+    ],
+]
+
+
+def get_version():
+    """
+    :return int(): number of migrations already applied to the database
+    """
+    return int(sql_db("PRAGMA user_version")[0][0])
+
+
+def migrate():
+    """
+    apply each pending migration atomically along with its version number
+    :return int(): the database version after migrating
+    """
+    version = get_version()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        queries = [{"query": query, "values": ()} for query in migration]
+        queries.append({"query": f"PRAGMA user_version={number}", "values": ()})
+        sql_db(queries)
+        print(it("green", f"database migrated to version {number}"))
+    return get_version()
+
+
+if __name__ == "__main__":
+    print("database version", migrate())
@@ -11,10 +11,45 @@ from sys import version as python_version
 
 # STAKE BTS MODULES
 from config import DB
+from db_migrate import migrate
 from utilities import it, sql_db
 
 # GLOBAL CONSTANTS
 PATH = os.path.dirname(os.path.abspath(__file__)) + "/database"
+SCHEMA = [
+    # block number table
+    """
+    CREATE TABLE block_num (block_num INTEGER);
+    """,
+    # stakes table
+    """
+    CREATE TABLE stakes (
+        client TEXT,
+        token TEXT,
+        amount INTEGER,
+        type TEXT,
+        start INTEGER,
+        due INTEGER,
+        processed INTEGER,
+        status TEXT,
+        block_start INTEGER,
+        block_processed INTEGER,
+        number INTEGER,
+        UNIQUE (
+        client, type, number, block_start, start
+        ) ON CONFLICT IGNORE
+    );
+    """,
+    # receipts table
+    """
+    CREATE TABLE receipts (
+        nonce INTEGER,
+        now INTEGER,
+        msg TEXT
+    );
+    """,
+]
+
 
 def main():
     """
@@ -31,49 +66,16 @@ def main():
     choice = input("Erase database? y + Enter to continue or Enter to cancel\n")
     # erase and recreate db
     if choice == "y":
-        command = "rm database/stake_bitshares.db"
+        # WAL journal mode leaves -wal and -shm files beside the database
+        command = (
+            "rm -f database/stake_bitshares.db "
+            + "database/stake_bitshares.db-wal database/stake_bitshares.db-shm"
+        )
         print("\033c", it("red", command), "\n")
         call(command.split())
         print("creating sqlite3:", it("green", DB), "\n")
         # batch database creation queries and process atomically
-        queries = []
-        # block number table
-        query = """
-        CREATE TABLE block_num (block_num INTEGER);
-        """
-        dml = {"query": query, "values": ()}
-        queries.append(dml)
-        # stakes table
-        query = """
-        CREATE TABLE stakes (
-            client TEXT,
-            token TEXT,
-            amount INTEGER,
-            type TEXT,
-            start INTEGER,
-            due INTEGER,
-            processed INTEGER,
-            status TEXT,
-            block_start INTEGER,
-            block_processed INTEGER,
-            number INTEGER,
-            UNIQUE (
-            client, type, number, block_start, start
-            ) ON CONFLICT IGNORE
-        );
-        """
-        dml = {"query": query, "values": ()}
-        queries.append(dml)
-        # receipts table
-        query = """
-        CREATE TABLE receipts (
-            nonce INTEGER,
-            now INTEGER,
-            msg TEXT
-        );
-        """
-        dml = {"query": query, "values": ()}
-        queries.append(dml)
+        queries = [{"query": query, "values": ()} for query in SCHEMA]
         # starting block number table
         query = """
         INSERT INTO block_num (block_num) VALUES (?);
@@ -82,6 +84,8 @@ def main():
         dml = {"query": query, "values": values}
         queries.append(dml)
         sql_db(queries)
+        # add indexes and bring the schema to the latest version
+        migrate()
         # display the tables' info
         query = """
         PRAGMA table_info (stakes)
@@ -100,6 +104,5 @@ def main():
             print(col)
 
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,393 @@
+"""
+BitShares.org StakeMachine
+Fake BitShares Node for Deterministic Load Testing
+serves generated blocks with encrypted memo transfers to the broker
+over websocket json rpc, point config.NODE at ws://127.0.0.1:FAKE_NODE_PORT
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from random import Random
+
+# THIRD PARTY MODULES
+import websockets
+
+# PYBITSHARES MODULES
+from bitsharesbase.account import PrivateKey
+from bitsharesbase.memo import encode_memo
+
+# STAKE BTS MODULES
+from config import BROKER, INVEST_AMOUNTS, MANAGERS
+from stake_bitshares import CLIENT_MEMOS
+
+# USER DEFINED CONSTANTS
+FAKE_NODE_PORT = 8090
+SEED = 1  # same seed, same chain
+CLIENTS = 1000  # client accounts sending transfers to the broker
+DENSITY = 0.05  # broker transfers per block, eg. 0.05 is one in every 20 blocks
+INVALID = 0.1  # share of broker transfers with an invalid memo or amount
+BACKLOG = 10000  # irreversible blocks behind head when the node starts
+BLOCK_SECONDS = 3  # seconds per new block, 0 stops block production
+BLOCK_START = 61000000  # first block number of the fake chain
+BROKER_BALANCE = 10 ** 9  # BTS held by the broker at genesis
+CHAIN_ID = "4018d7844c78f6a6c41c6a552b898022310fc5dec06da467ee7905a8dad512c8"
+PRECISION = 5  # of BTS, the core token 1.3.0
+
+# chain state, blocks are generated on request and never stored
+CHAIN = {"head": BLOCK_START + BACKLOG, "broker_balance": BROKER_BALANCE}
+# transactions broadcast and transfers from the broker since the node started
+STATS = {"broadcasts": 0, "transfers": 0, "begin": time.time()}
+
+
+def test_key(name):
+    """
+    :param str(name): account name
+    :return PrivateKey(): deterministic key for a fake account, never use on chain
+    """
+    return PrivateKey(hashlib.sha256(f"{SEED} {name}".encode()).hexdigest())
+
+
+def accounts():
+    """
+    :return dict(): {name: account object} for the broker, managers and clients
+    """
+    names = [BROKER] + MANAGERS + [f"client{i}" for i in range(CLIENTS)]
+    ret = {}
+    for idx, name in enumerate(names):
+        public_key = format(test_key(name).pubkey, "BTS")
+        authority = {
+            "weight_threshold": 1,
+            "account_auths": [],
+            "key_auths": [[public_key, 1]],
+            "address_auths": [],
+        }
+        account_id = f"1.2.{100 + idx}"
+        ret[name] = {
+            "id": account_id,
+            "name": name,
+            "owner": authority,
+            "active": authority,
+            "options": {
+                "memo_key": public_key,
+                "voting_account": "1.2.5",
+                "num_witness": 0,
+                "num_committee": 0,
+                "votes": [],
+                "extensions": [],
+            },
+            "statistics": f"2.6.{100 + idx}",
+            "membership_expiration_date": "1969-12-31T23:59:59",
+            "registrar": account_id,
+            "referrer": account_id,
+            # the broker and managers are lifetime members
+            "lifetime_referrer": account_id if idx <= len(MANAGERS) else "1.2.0",
+            "network_fee_percentage": 2000,
+            "lifetime_referrer_fee_percentage": 3000,
+            "referrer_rewards_percentage": 0,
+            "blacklisting_accounts": [],
+            "whitelisting_accounts": [],
+            "blacklisted_accounts": [],
+            "whitelisted_accounts": [],
+        }
+    return ret
+
+
+ACCOUNTS = accounts()
+ACCOUNT_IDS = {account["id"]: account for account in ACCOUNTS.values()}
+ASSET = {
+    "id": "1.3.0",
+    "symbol": "BTS",
+    "precision": PRECISION,
+    "issuer": "1.2.3",
+    "options": {
+        "max_supply": "360057050210207",
+        "market_fee_percent": 0,
+        "max_market_fee": "1000000000000000",
+        "issuer_permissions": 0,
+        "flags": 0,
+        "core_exchange_rate": {
+            "base": {"amount": 1, "asset_id": "1.3.0"},
+            "quote": {"amount": 1, "asset_id": "1.3.0"},
+        },
+        "whitelist_authorities": [],
+        "blacklist_authorities": [],
+        "whitelist_markets": [],
+        "blacklist_markets": [],
+        "description": "",
+        "extensions": [],
+    },
+    "dynamic_asset_data_id": "2.3.0",
+}
+
+
+def block_id(block_num):
+    """
+    :return str(): deterministic 20 byte block id, prefixed with the block number
+    """
+    digest = hashlib.sha256(f"{SEED} {block_num}".encode()).hexdigest()
+    return f"{block_num:08x}" + digest[:32]
+
+
+def block_time(block_num):
+    """
+    :return str(): iso timestamp of a block, the head block is now
+    """
+    seconds = time.time() - (CHAIN["head"] - block_num) * max(BLOCK_SECONDS, 1)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+
+
+def transfer(rng, block_num, idx):
+    """
+    :return list(): a transfer operation from a client to the broker
+    """
+    client = rng.choice(MANAGERS + [f"client{i}" for i in range(CLIENTS)])
+    memo_type = rng.choice(CLIENT_MEMOS)
+    amount = rng.choice(INVEST_AMOUNTS)
+    if rng.random() < INVALID:
+        memo_type, amount = rng.choice([("invalid", amount), (memo_type, 1234)])
+    sender = test_key(client)
+    nonce = str(block_num * 1000 + idx)
+    message = encode_memo(
+        sender,
+        test_key(BROKER).pubkey,
+        nonce,
+        json.dumps({"type": memo_type}),
+    )
+    return [
+        0,
+        {
+            "fee": {"amount": 86869, "asset_id": "1.3.0"},
+            "from": ACCOUNTS[client]["id"],
+            "to": ACCOUNTS[BROKER]["id"],
+            "amount": {"amount": amount * 10 ** PRECISION, "asset_id": "1.3.0"},
+            "memo": {
+                "from": format(sender.pubkey, "BTS"),
+                "to": format(test_key(BROKER).pubkey, "BTS"),
+                "nonce": nonce,
+                "message": message,
+            },
+            "extensions": [],
+        },
+    ]
+
+
+def get_block(block_num):
+    """
+    :return dict(): a deterministic block, None beyond the head block
+    """
+    if not BLOCK_START <= block_num <= CHAIN["head"]:
+        return None
+    rng = Random(f"{SEED} {block_num}")
+    # poisson-ish count of broker transfers averaging DENSITY per block
+    count = int(DENSITY) + int(rng.random() < DENSITY - int(DENSITY))
+    return {
+        "previous": block_id(block_num - 1),
+        "timestamp": block_time(block_num),
+        "witness": "1.6.1",
+        "transaction_merkle_root": "0" * 40,
+        "extensions": [],
+        "witness_signature": "0" * 130,
+        "block_id": block_id(block_num),
+        "transactions": [
+            {
+                "ref_block_num": block_num & 0xFFFF,
+                "ref_block_prefix": 0,
+                "expiration": block_time(block_num + 10),
+                "operations": [transfer(rng, block_num, idx)],
+                "extensions": [],
+                "signatures": [],
+                "operation_results": [[0, {}]],
+            }
+            for idx in range(count)
+        ],
+    }
+
+
+def dynamic_global_properties():
+    """
+    :return dict(): object 2.1.0, irreversible lags the head by 15 blocks
+    """
+    head = CHAIN["head"]
+    return {
+        "id": "2.1.0",
+        "head_block_number": head,
+        "head_block_id": block_id(head),
+        "time": block_time(head),
+        "current_witness": "1.6.1",
+        "last_irreversible_block_num": head - 15,
+        "recently_missed_count": 0,
+        "current_aslot": head,
+        "dynamic_flags": 0,
+    }
+
+
+def get_objects(ids):
+    """
+    :return list(): accounts, the core asset, and global properties by object id
+    """
+    ret = []
+    for object_id in ids:
+        if object_id in ACCOUNT_IDS:
+            ret.append(ACCOUNT_IDS[object_id])
+        elif object_id == "1.3.0":
+            ret.append(ASSET)
+        elif object_id == "2.1.0":
+            ret.append(dynamic_global_properties())
+        elif object_id == "2.0.0":
+            ret.append(
+                {
+                    "id": "2.0.0",
+                    "parameters": {"block_interval": BLOCK_SECONDS or 3},
+                }
+            )
+        else:
+            ret.append(None)
+    return ret
+
+
+def balances(account_id):
+    """
+    :return list(): the BTS balance of an account
+    """
+    amount = 10 ** 6 * 10 ** PRECISION
+    if account_id == ACCOUNTS[BROKER]["id"]:
+        amount = CHAIN["broker_balance"] * 10 ** PRECISION
+    return [{"amount": amount, "asset_id": "1.3.0"}]
+
+
+def broadcast(trx):
+    """
+    apply transfers from the broker to the fake chain
+    :return dict(): transaction id and the block it would be included in
+    """
+    STATS["broadcasts"] += 1
+    for operation in trx.get("operations", []):
+        if operation[0] == 0 and operation[1]["from"] == ACCOUNTS[BROKER]["id"]:
+            STATS["transfers"] += 1
+            amount = operation[1]["amount"]["amount"] / 10 ** PRECISION
+            CHAIN["broker_balance"] -= amount
+    elapsed = time.time() - STATS["begin"]
+    print(
+        f"broadcast {STATS['broadcasts']} transfers {STATS['transfers']} "
+        + f"rate {round(STATS['transfers'] / elapsed, 1)}/s"
+    )
+    return {"id": hashlib.sha256(json.dumps(trx).encode()).hexdigest()[:40]}
+
+
+def deposit(amount):
+    """
+    credit the broker, eg. a bittrex withdrawal settled by mock_bittrex.py
+    :return int(): the broker's new balance
+    """
+    CHAIN["broker_balance"] += float(amount)
+    print(f"deposit {amount} to broker, balance {int(CHAIN['broker_balance'])}")
+    return int(CHAIN["broker_balance"])
+
+
+def dispatch(method, params):
+    """
+    :param str(method): database, history, or network_broadcast api method
+    :param list(params): method arguments
+    :return: json serializable result
+    """
+    methods = {
+        "get_chain_properties": lambda: {"id": "2.11.0", "chain_id": CHAIN_ID},
+        "get_chain_id": lambda: CHAIN_ID,
+        "get_config": lambda: {"GRAPHENE_ADDRESS_PREFIX": "BTS"},
+        "get_dynamic_global_properties": dynamic_global_properties,
+        "get_global_properties": lambda: get_objects(["2.0.0"])[0],
+        "get_block": get_block,
+        "get_block_header": get_block,
+        "get_objects": get_objects,
+        "get_account_by_name": lambda name: ACCOUNTS.get(name),
+        "lookup_account_names": lambda names: [ACCOUNTS.get(i) for i in names],
+        "get_accounts": lambda ids: get_objects(ids),
+        "get_full_accounts": lambda ids, _: [
+            [i, {"account": ACCOUNTS.get(i) or ACCOUNT_IDS.get(i)}] for i in ids
+        ],
+        "get_account_balances": lambda account_id, _: balances(account_id),
+        "get_named_account_balances": lambda name, _: balances(
+            ACCOUNTS[name]["id"]
+        ),
+        "get_required_fees": lambda ops, _: [
+            {"amount": 86869, "asset_id": "1.3.0"} for _ in ops
+        ],
+        "get_potential_signatures": lambda _: [],
+        "get_required_signatures": lambda *_: [],
+        "lookup_asset_symbols": lambda symbols: [ASSET for _ in symbols],
+        "get_assets": lambda ids: [ASSET for _ in ids],
+        "broadcast_transaction": lambda trx, *_: broadcast(trx),
+        "broadcast_transaction_synchronous": lambda trx, *_: broadcast(trx),
+        "get_account_history": lambda *_: [],
+        "get_relative_account_history": lambda *_: [],
+        "fake_deposit": deposit,
+        "login": lambda *_: True,
+        "get_api_by_name": lambda name: name,
+    }
+    if method in methods:
+        return methods[method](*params)
+    if method.startswith("set_") or method in ("database", "history"):
+        return None
+    raise ValueError(f"fake node does not implement {method}")
+
+
+async def serve(websocket, *_):
+    """
+    json rpc over one websocket, requests are answered in order
+    """
+    async for message in websocket:
+        request = json.loads(message)
+        params = request.get("params", [])
+        # {"method": "call", "params": [api, method, args]} or {"method": m, ...}
+        method, args = request.get("method"), params
+        if method == "call":
+            method, args = params[1], params[2]
+        response = {"id": request.get("id"), "jsonrpc": "2.0"}
+        try:
+            response["result"] = dispatch(method, args)
+        except Exception as error:
+            response["error"] = {"message": f"{type(error).__name__} {error.args}"}
+        await websocket.send(json.dumps(response))
+
+
+async def produce():
+    """
+    add a new head block every BLOCK_SECONDS seconds
+    """
+    while BLOCK_SECONDS:
+        await asyncio.sleep(BLOCK_SECONDS)
+        CHAIN["head"] += 1
+
+
+async def main_async():
+    """
+    serve the fake node until interrupted
+    """
+    async with websockets.serve(serve, "127.0.0.1", FAKE_NODE_PORT, max_size=None):
+        await produce()
+        await asyncio.Future()
+
+
+def main():
+    """
+    print the test keys for importing into a wallet, then serve the fake node
+    """
+    print("\033c")
+    print(f"fake node ws://127.0.0.1:{FAKE_NODE_PORT} seed {SEED}")
+    print(f"{BACKLOG} blocks backlog, {DENSITY} broker transfers per block\n")
+    if "--keys" in sys.argv:
+        for name in [BROKER] + MANAGERS:
+            print(name, "wif", str(test_key(name)))
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ from sqlite3 import connect as sql
 # STAKEBTS MODULES
 from config import DB
 from preexisting_contracts import STAKES
-from rpc import pybitshares_reconnect
+from rpc import pybitshares_connection
 from stake_bitshares import stake_start
 
 # USER DEFINED CONSTANTS
@@ -38,8 +38,8 @@ def get_dynamic_globals():
     but allows us to associate a recent block num to unix time for dev
     :return dict():
     """
-    bitshares, _ = pybitshares_reconnect()
-    print(bitshares.rpc.get_dynamic_global_properties())
+    with pybitshares_connection() as (bitshares, _):
+        print(bitshares.rpc.get_dynamic_global_properties())
 
 
 def convert_stakes_to_matrix(stakes):
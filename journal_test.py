@@ -0,0 +1,58 @@
+"""
+BitShares.org StakeMachine
+Unit Test that a single receipt is committed within RECEIPT_FLUSH seconds
+runs against a temporary database, exits 1 on failure
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=import-outside-toplevel
+
+# STANDARD PYTHON MODULES
+import os
+import sys
+import tempfile
+import time
+
+# STAKE BTS MODULES
+import config
+
+SLACK = 0.5  # seconds allowed beyond RECEIPT_FLUSH for the commit itself
+
+
+def committed_within(seconds, count):
+    """
+    :return bool(): whether count receipts are in the database within seconds
+    """
+    from utilities import sql_db
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if sql_db("SELECT COUNT(*) FROM receipts")[0][0] == count:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def main():
+    """
+    append one receipt, then another after the first is committed,
+    each must be committed without a flush and without a full batch
+    """
+    config.DB = os.path.join(tempfile.mkdtemp(), "stake_bitshares.db")
+    config.LOG_COLOR = False
+    from receipt_journal import journal_append, journal_stats
+    from utilities import sql_db
+
+    sql_db("CREATE TABLE receipts (nonce INTEGER, now INTEGER, msg TEXT)")
+    failed = False
+    for count in (1, 2):
+        journal_append(0, f"receipt {count}")
+        ok = committed_within(config.RECEIPT_FLUSH + SLACK, count)
+        failed = failed or not ok
+        print("receipt", count, "committed" if ok else "NOT COMMITTED", journal_stats())
+    sys.exit(int(failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+BitShares.org StakeMachine
+Structured Logging
+levelled JSON lines written by a background thread from a bounded queue
+with an optional colored terminal sink, secrets are redacted
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except, protected-access
+
+# STANDARD PYTHON MODULES
+import atexit
+import json
+import os
+import sys
+import time
+from queue import Full, Queue
+from threading import Lock, Thread
+
+# STAKE BTS MODULES
+from config import LOG_COLOR, LOG_FILE, LOG_LEVEL, LOG_QUEUE
+from metrics import metric_inc
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+# terminal sink colors, as in utilities.it()
+COLORS = {"DEBUG": 94, "INFO": 92, "WARN": 93, "ERROR": 91}
+# any field whose name contains one of these is never written
+SECRETS = ("password", "secret", "signature", "api-key", "api_key", "wif", "private")
+# records awaiting the writer thread, full queues drop records rather than block
+LOG = {"queue": Queue(LOG_QUEUE), "thread": None, "lock": Lock()}
+
+
+def redact(fields):
+    """
+    :param dict(fields): log record fields, nested dicts and lists are redacted too
+    :return dict(): copy of fields with secret values replaced by "***"
+    """
+    if isinstance(fields, dict):
+        return {
+            key: "***"
+            if any(i in str(key).lower() for i in SECRETS)
+            else redact(value)
+            for key, value in fields.items()
+        }
+    if isinstance(fields, (list, tuple)):
+        return [redact(value) for value in fields]
+    return fields
+
+
+def log(level, event, **fields):
+    """
+    queue a structured log record, usage:
+        log("INFO", "incoming transfer", client=client, amount=amount)
+    the callsite is read from the caller's frame, not inspect.stack()
+    :param str(level): DEBUG, INFO, WARN, or ERROR
+    :param str(event): short description of what happened
+    :return None:
+    """
+    if LEVELS[level] < LEVELS[LOG_LEVEL]:
+        return
+    frame = sys._getframe(1)
+    record = {
+        "ts": round(time.time(), 3),
+        "level": level,
+        "event": event,
+        "at": f"{os.path.basename(frame.f_code.co_filename)}:"
+        + f"{frame.f_code.co_name}:{frame.f_lineno}",
+        **redact(fields),
+    }
+    with LOG["lock"]:
+        if LOG["thread"] is None:
+            LOG["thread"] = Thread(target=log_writer, daemon=True)
+            LOG["thread"].start()
+    try:
+        LOG["queue"].put_nowait(record)
+    except Full:
+        metric_inc("stake_log_dropped_total", level=level)
+
+
+def log_writer():
+    """
+    the only thread which writes log records, to LOG_FILE and optionally the terminal
+    """
+    with open(LOG_FILE, "a") as handle:
+        while True:
+            record = LOG["queue"].get()
+            try:
+                line = json.dumps(record, default=str)
+                handle.write(line + "\n")
+                if LOG_COLOR:
+                    print(f"\033[{COLORS[record['level']]}m{line}\033[0m")
+                if LOG["queue"].empty():
+                    handle.flush()
+            except Exception as error:
+                print("log writer", type(error).__name__, error.args)
+            finally:
+                LOG["queue"].task_done()
+
+
+def log_flush():
+    """
+    block until every queued record is written
+    :return None:
+    """
+    if LOG["thread"] is not None:
+        LOG["queue"].join()
+
+
+atexit.register(log_flush)
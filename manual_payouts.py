@@ -4,11 +4,9 @@ Hung Payment Handler
 BitShares Management Group Co. Ltd.
 """
 
-# STANDARD PYTHON MODULES
-from getpass import getpass
-
 # STAKE BTS MODULES
-from config import BROKER
+from config import PAYMENT_POLL
+from db_migrate import migrate
 from stake_bitshares import payment_parent
 from utilities import munix, sql_db
 
@@ -18,6 +16,7 @@ def main():
     Handle hung payments with status "processing" due to insufficient funds
     """
     print("\033c")
+    migrate()
     # read from database gather list of payments due
     query = (
         "SELECT amount, client, start, number, type FROM stakes "
@@ -30,13 +29,9 @@ def main():
     choice = input("\ny + Enter to make these payments, or just Enter to abort\n")
 
     if choice == "y":
-        keys = {
-            "broker": BROKER,
-            "password": getpass(
-                f"\nInput Pybitshares Password for {BROKER} and press ENTER:\n"
-            ),
-        }
-        payment_parent(payments_due, keys)
+        # submit to the persistent payments queue served by the running bot
+        payment_parent(payments_due)
+        print(f"\npayments queued, the running bot takes them within {PAYMENT_POLL}s")
 
 
 if __name__ == "__main__":
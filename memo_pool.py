@@ -0,0 +1,97 @@
+"""
+BitShares.org StakeMachine
+Process Pool Memo Decryption for Replay
+each worker process decrypts a batch of memos with the broker's memo key
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import os
+from concurrent.futures import ProcessPoolExecutor
+from json import loads as json_loads
+from multiprocessing import get_context
+
+# PYBITSHARES MODULES
+from bitsharesbase.account import PrivateKey, PublicKey
+from bitsharesbase.memo import decode_memo
+
+# STAKE BTS MODULES
+from config import MEMO_WORKERS
+from metrics import timed
+
+# process pool, started on first use
+MEMO_POOL = {"executor": None, "workers": MEMO_WORKERS or os.cpu_count() or 1}
+
+
+def memo_parse(decrypted_memo, valid):
+    """
+    validate a decrypted memo, json or a bare memo type
+    :param str(decrypted_memo): plain text memo with spaces removed
+    :param list(valid): accepted memo types
+    :return dict(): {"type": ...}, type "invalid" if not accepted
+    """
+    try:
+        msg = json_loads(decrypted_memo)
+    except Exception:
+        msg = {"type": decrypted_memo}
+    try:
+        if msg["type"] in valid:
+            return msg
+    except Exception:
+        pass
+    return {"type": "invalid"}
+
+
+def memo_decrypt_batch(wif, memos, valid):
+    """
+    runs in a worker process, decrypt memos sent to the broker
+    :param str(wif): the broker's memo private key
+    :param list(memos): memo dicts of transfer operations
+    :param list(valid): accepted memo types
+    :return list(dict()): {"type": ...} for each memo, in the original order
+    """
+    private_key = PrivateKey(wif)
+    own = format(private_key.pubkey, "BTS")
+    ret = []
+    for memo in memos:
+        try:
+            # the other party's public key, usually the sender's
+            public_key = memo["from"] if memo["to"] == own else memo["to"]
+            decrypted_memo = decode_memo(
+                private_key,
+                PublicKey(public_key, prefix=public_key[:3]),
+                memo["nonce"],
+                memo["message"],
+            )
+            ret.append(memo_parse(decrypted_memo.replace(" ", ""), valid))
+        except Exception:
+            ret.append({"type": "invalid"})
+    return ret
+
+
+@timed("stake_memo_pool_decrypt_seconds")
+def memo_pool_decrypt(wif, memos, valid):
+    """
+    decrypt many memos at once, split evenly over the process pool
+    :param str(wif): the broker's memo private key
+    :param list(memos): memo dicts of transfer operations
+    :param list(valid): accepted memo types
+    :return list(dict()): {"type": ...} for each memo, in the original order
+    """
+    if not memos:
+        return []
+    if MEMO_POOL["executor"] is None:
+        # spawned workers import only this module, never the bot's threads
+        MEMO_POOL["executor"] = ProcessPoolExecutor(
+            MEMO_POOL["workers"], mp_context=get_context("spawn")
+        )
+    size = -(-len(memos) // MEMO_POOL["workers"])
+    chunks = [memos[i : i + size] for i in range(0, len(memos), size)]
+    futures = [
+        MEMO_POOL["executor"].submit(memo_decrypt_batch, wif, chunk, valid)
+        for chunk in chunks
+    ]
+    return [msg for future in futures for msg in future.result()]
@@ -0,0 +1,162 @@
+"""
+BitShares.org StakeMachine
+Hot Path Counters, Latency Histograms and Gauges
+served in the Prometheus text format on a local http endpoint
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# STAKE BTS MODULES
+from config import METRICS_HOST, METRICS_PORT
+
+# upper bounds in seconds, from a sql write up to a payout waiting on cover funds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 600, 3600, 43200)
+# counters and histograms by name and labels, gauges are read when scraped
+METRICS = {"counters": {}, "histograms": {}, "gauges": {}, "lock": Lock()}
+
+
+def metric_key(name, labels):
+    """
+    :return tuple(): name and sorted labels, eg. ("x", (("api", "1"),))
+    """
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def metric_inc(name, value=1, **labels):
+    """
+    increment a counter
+    """
+    key = metric_key(name, labels)
+    with METRICS["lock"]:
+        METRICS["counters"][key] = METRICS["counters"].get(key, 0) + value
+
+
+def metric_observe(name, seconds, **labels):
+    """
+    record a latency in a histogram
+    """
+    key = metric_key(name, labels)
+    with METRICS["lock"]:
+        histogram = METRICS["histograms"].setdefault(
+            key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        )
+        for idx, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][idx] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+def metric_gauge(name, func):
+    """
+    register a gauge, func() is called for its value when metrics are scraped
+    """
+    with METRICS["lock"]:
+        METRICS["gauges"][name] = func
+
+
+def timed(name):
+    """
+    decorator, histogram of the duration of every call, and a counter of errors
+    usage:
+        @timed("stake_check_block_seconds")
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            begin = time.time()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metric_inc(name.replace("_seconds", "_errors_total"))
+                raise
+            finally:
+                metric_observe(name, time.time() - begin)
+
+        return wrapper
+
+    return decorator
+
+
+def metric_labels(labels, extra=()):
+    """
+    :return str(): prometheus label set, eg. {api="1",le="0.5"}
+    """
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def metrics_text():
+    """
+    :return str(): all metrics in the prometheus text exposition format
+    """
+    lines = []
+    with METRICS["lock"]:
+        counters = dict(METRICS["counters"])
+        histograms = {
+            key: dict(histogram, buckets=list(histogram["buckets"]))
+            for key, histogram in METRICS["histograms"].items()
+        }
+        gauges = dict(METRICS["gauges"])
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"{name}{metric_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            le = (("le", str(bound)),)
+            lines.append(f"{name}_bucket{metric_labels(labels, le)} {count}")
+        le = (("le", "+Inf"),)
+        lines.append(f"{name}_bucket{metric_labels(labels, le)} {histogram['count']}")
+        lines.append(f"{name}_sum{metric_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{metric_labels(labels)} {histogram['count']}")
+    for name, func in sorted(gauges.items()):
+        try:
+            lines.append(f"{name} {float(func())}")
+        except Exception:
+            pass  # a gauge which cannot be read is left out of this scrape
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        serve metrics_text()
+        """
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        scrapes are not logged
+        """
+
+
+def metrics_serve():
+    """
+    serve metrics on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables
+    :return None:
+    """
+    if METRICS_PORT:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
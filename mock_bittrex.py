@@ -0,0 +1,239 @@
+"""
+BitShares.org StakeMachine
+Mock Bittrex V3 API for Payout and Cover Benchmarking
+verifies request signatures, injects latency and failures, and settles
+withdrawals to the broker on fake_node.py after a delay
+set config.BITTREX_API_URL to http://127.0.0.1:MOCK_PORT/v3/
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except, invalid-name
+
+# STANDARD PYTHON MODULES
+import hashlib
+import hmac
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import random, uniform
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+# THIRD PARTY MODULES
+from websocket import create_connection
+
+# STAKE BTS MODULES
+from config import BROKER
+
+# USER DEFINED CONSTANTS
+MOCK_PORT = 8091
+FAKE_NODE = "ws://127.0.0.1:8090"  # fake_node.py to credit settled withdrawals, "" off
+# api key: (secret, BTS balance) for corporate accounts 1, 2 and 3, enter at login
+ACCOUNTS = {
+    "key1": ("secret1", 100000),
+    "key2": ("secret2", 100000),
+    "key3": ("secret3", 100000),
+}
+LATENCY = 0.2  # mean seconds added to every response
+FAILURE = 0.02  # share of requests answered 503 before they are processed
+TIMEOUT = 0.01  # share of withdrawals processed but answered too late, see STALL
+STALL = 35  # seconds a timed out withdrawal stalls, beyond the client read timeout
+SETTLE = 30  # seconds from a withdrawal request to its completion on chain
+FEE = 5  # BTS withdrawal fee
+MAX_SKEW = 60000  # milliseconds a signed request timestamp may differ from ours
+
+# balances and withdrawals by api key, guarded by one lock
+STATE = {
+    "balances": {key: balance for key, (_, balance) in ACCOUNTS.items()},
+    "withdrawals": {key: [] for key in ACCOUNTS},
+    "lock": Lock(),
+}
+
+
+def verify(handler, body):
+    """
+    check the request is signed as Bittrex._sign() signs it
+    :return str(): api key of the verified account, None if verification failed
+    """
+    api_key = handler.headers.get("Api-Key", "")
+    timestamp = handler.headers.get("Api-Timestamp", "0")
+    content_hash = handler.headers.get("Api-Content-Hash", "")
+    signature = handler.headers.get("Api-Signature", "")
+    if api_key not in ACCOUNTS:
+        return None
+    if abs(int(time.time() * 1000) - int(timestamp)) > MAX_SKEW:
+        return None
+    if content_hash != hashlib.sha512(body).hexdigest():
+        return None
+    uri = f"http://{handler.headers.get('Host')}{handler.path}"
+    pre_sign = timestamp + uri + handler.command + content_hash
+    expected = hmac.new(
+        ACCOUNTS[api_key][0].encode(), pre_sign.encode(), hashlib.sha512
+    ).hexdigest()
+    return api_key if hmac.compare_digest(expected, signature) else None
+
+
+def settle(withdrawal):
+    """
+    complete a withdrawal after SETTLE seconds, crediting the broker on the fake node
+    """
+    time.sleep(SETTLE)
+    if withdrawal["cryptoAddress"] == BROKER and FAKE_NODE:
+        try:
+            node = create_connection(FAKE_NODE)
+            request = {
+                "id": 1,
+                "method": "call",
+                "params": ["database", "fake_deposit", [withdrawal["quantity"]]],
+            }
+            node.send(json.dumps(request))
+            node.recv()
+            node.close()
+        except Exception as error:
+            print("fake node deposit failed", type(error).__name__, error.args)
+    with STATE["lock"]:
+        withdrawal["status"] = "COMPLETED"
+        withdrawal["txId"] = uuid4().hex + uuid4().hex[:8]
+        withdrawal["completedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    print("settled", withdrawal["id"], withdrawal["quantity"])
+
+
+def post_withdrawal(api_key, params):
+    """
+    :return tuple(int(status), response): a new or, by clientWithdrawalId, a repeat
+    """
+    client_withdrawal_id = params.get("clientWithdrawalId")
+    quantity = float(params["quantity"])
+    with STATE["lock"]:
+        if client_withdrawal_id and any(
+            i.get("clientWithdrawalId") == client_withdrawal_id
+            for i in STATE["withdrawals"][api_key]
+        ):
+            return 409, {"code": "CLIENT_WITHDRAWAL_ID_ALREADY_EXISTS"}
+        if quantity + FEE > STATE["balances"][api_key]:
+            return 409, {"code": "INSUFFICIENT_FUNDS"}
+        STATE["balances"][api_key] -= quantity + FEE
+        withdrawal = {
+            "id": str(uuid4()),
+            "currencySymbol": params["currencySymbol"],
+            "quantity": params["quantity"],
+            "cryptoAddress": params["cryptoAddress"],
+            "txCost": FEE,
+            "txId": None,
+            "status": "REQUESTED",
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "completedAt": None,
+            "clientWithdrawalId": client_withdrawal_id,
+        }
+        STATE["withdrawals"][api_key].insert(0, withdrawal)
+    Thread(target=settle, args=(withdrawal,), daemon=True).start()
+    return 201, withdrawal
+
+
+def get_withdrawals(api_key, status, query):
+    """
+    open or closed withdrawals, newest first, paged by nextPageToken and pageSize
+    :return tuple(int(status), list()):
+    """
+    with STATE["lock"]:
+        ret = [
+            dict(i)
+            for i in STATE["withdrawals"][api_key]
+            if (i["status"] == "COMPLETED") == (status == "closed")
+        ]
+    if "nextPageToken" in query:
+        ids = [i["id"] for i in ret]
+        token = query["nextPageToken"][0]
+        ret = ret[ids.index(token) + 1 :] if token in ids else []
+    return 200, ret[: int(query.get("pageSize", ["100"])[0])]
+
+
+def route(api_key, method, path, query, body):
+    """
+    :return tuple(int(status), response): for each endpoint bittrex_api.py uses
+    """
+    if method == "GET" and path == "balances":
+        with STATE["lock"]:
+            available = str(float(STATE["balances"][api_key]))
+        return 200, [
+            {"currencySymbol": "BTS", "total": available, "available": available}
+        ]
+    if method == "POST" and path == "withdrawals":
+        return post_withdrawal(api_key, json.loads(body or b"{}"))
+    if method == "GET" and path in ("withdrawals/open", "withdrawals/closed"):
+        return get_withdrawals(api_key, path.split("/")[1], query)
+    if method == "GET" and path.startswith("withdrawals/ByClientWithdrawalId/"):
+        client_withdrawal_id = path.rsplit("/", 1)[1]
+        with STATE["lock"]:
+            for withdrawal in STATE["withdrawals"][api_key]:
+                if withdrawal["clientWithdrawalId"] == client_withdrawal_id:
+                    return 200, dict(withdrawal)
+        return 404, {"code": "NOT_FOUND"}
+    return 404, {"code": "NOT_FOUND"}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Bittrex V3 endpoints under /v3/
+    """
+
+    def handle_request(self):
+        """
+        verify, delay, maybe fail, then route
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        time.sleep(uniform(0, 2 * LATENCY))
+        if random() < FAILURE:
+            self.respond(503, {"code": "SERVICE_UNAVAILABLE"})
+            return
+        api_key = verify(self, body)
+        if api_key is None:
+            self.respond(401, {"code": "INVALID_SIGNATURE"})
+            return
+        url = urlparse(self.path)
+        path = url.path.split("/v3/", 1)[-1]
+        status, response = route(
+            api_key, self.command, path, parse_qs(url.query), body
+        )
+        if self.command == "POST" and random() < TIMEOUT:
+            # processed, but the client gives up before the answer arrives
+            time.sleep(STALL)
+        self.respond(status, response)
+
+    def respond(self, status, response):
+        """
+        send a json response
+        """
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_DELETE = handle_request
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        requests are not logged
+        """
+
+
+def main():
+    """
+    serve the mock until interrupted
+    """
+    print("\033c")
+    print(f"mock bittrex http://127.0.0.1:{MOCK_PORT}/v3/")
+    print(f"latency {LATENCY}s, failures {FAILURE}, settlement {SETTLE}s")
+    print("api keys and secrets", {k: v[0] for k, v in ACCOUNTS.items()}, "\n")
+    ThreadingHTTPServer(("127.0.0.1", MOCK_PORT), MockHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
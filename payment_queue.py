@@ -0,0 +1,245 @@
+"""
+BitShares.org StakeMachine
+Persistent Payment Queue Served by a Bounded Worker Pool
+BitShares Management Group Co. Ltd.
+"""
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import time
+from collections import deque
+from json import dumps as json_dumps
+from json import loads as json_loads
+from threading import Condition, Thread
+
+# STAKE BTS MODULES
+from config import PAYMENT_POLL, PAYMENT_WORKERS
+from metrics import metric_inc, metric_observe
+from utilities import exception_handler, it, line_info, munix, sql_db
+
+# returned by a payment target which handed its job to another thread to resume
+PARKED = "parked"
+# queued jobs in submission order, ids of jobs queued, running or parked in this
+# process, clients with a job running or parked, parked jobs by id, params of jobs
+# resumed before their worker finished parking them, and queue latency metrics
+PAYMENTS = {
+    "queue": deque(),
+    "ids": set(),
+    "running": set(),
+    "parked": {},
+    "resumed": {},
+    "condition": Condition(),
+    "stats": {"done": 0, "failed": 0, "wait": 0, "wait_max": 0, "run": 0},
+}
+
+
+def payment_enqueue(job):
+    """
+    add a job to the in memory queue unless it is already known to this process
+    :param dict(job): with keys ["id", "client", "params", "queued"]
+    :return None:
+    """
+    with PAYMENTS["condition"]:
+        if job["id"] not in PAYMENTS["ids"]:
+            PAYMENTS["ids"].add(job["id"])
+            PAYMENTS["queue"].append(job)
+            PAYMENTS["condition"].notify_all()
+
+
+def payment_submit(params):
+    """
+    SECURITY persist a payment to the payments table before it is queued,
+    so a crash does not lose queued payouts; safe to call from any process
+    :param dict(params): payment_child() params, must include "client"
+    :return int(): id of the queued payment
+    """
+    queued = munix()
+    query = (
+        "INSERT INTO payments (client, params, status, queued, started, finished) "
+        + "VALUES (?,?,'queued',?,0,0)"
+    )
+    values = (params["client"], json_dumps(params), queued)
+    queries = [
+        {"query": query, "values": values},
+        {"query": "SELECT last_insert_rowid()", "values": ()},
+    ]
+    job_id = sql_db(queries)[0][0]
+    payment_enqueue(
+        {"id": job_id, "client": params["client"], "params": params, "queued": queued}
+    )
+    return job_id
+
+
+def payment_load():
+    """
+    queue payments persisted as queued, including those submitted by other
+    processes such as manual_payouts.py
+    :return None:
+    """
+    query = (
+        "SELECT id, client, params, queued FROM payments "
+        + "WHERE status='queued' ORDER BY id"
+    )
+    for job_id, client, params, queued in sql_db(query):
+        payment_enqueue(
+            {
+                "id": job_id,
+                "client": client,
+                "params": json_loads(params),
+                "queued": queued,
+            }
+        )
+
+
+def payment_claim():
+    """
+    block until a job is available whose client has no other job running,
+    this preserves the order of each client's payments
+    :return dict(job): the oldest runnable job
+    """
+    with PAYMENTS["condition"]:
+        while True:
+            for job in PAYMENTS["queue"]:
+                if job["client"] not in PAYMENTS["running"]:
+                    PAYMENTS["queue"].remove(job)
+                    PAYMENTS["running"].add(job["client"])
+                    return job
+            PAYMENTS["condition"].wait()
+
+
+def payment_loader():
+    """
+    every PAYMENT_POLL seconds queue payments submitted by other processes,
+    regardless of how busy the workers are
+    :return None:
+    """
+    while True:
+        time.sleep(PAYMENT_POLL)
+        try:
+            payment_load()
+        except Exception as error:
+            print(exception_handler(error), line_info())
+
+
+def payment_requeue(job, params):
+    """
+    queue a parked job again, ahead of all others, for the next free worker
+    :param dict(job): the parked job
+    :param dict(params): its params as resumed
+    :return None:
+    """
+    query = "UPDATE payments SET status='queued' WHERE id=?"
+    sql_db(query, (job["id"],))
+    with PAYMENTS["condition"]:
+        job["params"] = params
+        PAYMENTS["running"].discard(job["client"])
+        PAYMENTS["queue"].appendleft(job)
+        PAYMENTS["condition"].notify_all()
+
+
+def payment_resume(params):
+    """
+    resume a parked job, possibly before its worker has finished parking it
+    :param dict(params): the parked job's params, including in memory state
+        for the target such as the treasury's verdict; "payment_id" is its id
+    :return None:
+    """
+    with PAYMENTS["condition"]:
+        job = PAYMENTS["parked"].pop(params["payment_id"], None)
+        if job is None:
+            # the worker requeues it once the target has returned PARKED
+            PAYMENTS["resumed"][params["payment_id"]] = params
+            return
+    payment_requeue(job, params)
+
+
+def payment_worker(target, keys):
+    """
+    run forever making one queued payment at a time
+    a target which returns PARKED frees this worker, the job is finished later
+    by whichever worker claims it after payment_resume()
+    :param callable(target): called with (params, keys) to make the payment
+    :param dict(keys): pybitshares wallet password and bittrex keys
+    :return None:
+    """
+    while True:
+        job = payment_claim()
+        started = munix()
+        query = "UPDATE payments SET status='running', started=? WHERE id=?"
+        sql_db(query, (started, job["id"]))
+        job["params"]["payment_id"] = job["id"]
+        failed = False
+        try:
+            if target(job["params"], keys) == PARKED:
+                query = "UPDATE payments SET status='parked' WHERE id=?"
+                sql_db(query, (job["id"],))
+                # the client stays running, so its later payments keep their order
+                with PAYMENTS["condition"]:
+                    params = PAYMENTS["resumed"].pop(job["id"], None)
+                    if params is None:
+                        PAYMENTS["parked"][job["id"]] = job
+                if params is not None:
+                    payment_requeue(job, params)
+                continue
+        except Exception as error:
+            failed = True
+            print(exception_handler(error), line_info())
+        finished = munix()
+        query = "UPDATE payments SET status='done', finished=? WHERE id=?"
+        sql_db(query, (finished, job["id"]))
+        # end to end, from queued to paid, in seconds
+        metric_observe("stake_payout_seconds", (finished - job["queued"]) / 1000)
+        metric_inc("stake_payouts_total", failed=int(failed))
+        with PAYMENTS["condition"]:
+            PAYMENTS["ids"].discard(job["id"])
+            PAYMENTS["running"].discard(job["client"])
+            stats = PAYMENTS["stats"]
+            stats["done"] += 1
+            stats["failed"] += int(failed)
+            stats["wait"] += started - job["queued"]
+            stats["wait_max"] = max(stats["wait_max"], started - job["queued"])
+            stats["run"] += finished - started
+            PAYMENTS["condition"].notify_all()
+
+
+def payment_workers(target, keys):
+    """
+    start the bounded worker pool after recovering the persisted queue
+    SECURITY payments interrupted mid run are never retried automatically,
+    their stakes remain "processing" for manual_payouts.py
+    :param callable(target): called with (params, keys) to make each payment
+    :param dict(keys): pybitshares wallet password and bittrex keys
+    :return None:
+    """
+    interrupted = sql_db("SELECT id, params FROM payments WHERE status='running'")
+    if interrupted:
+        print(it("red", "WARN payments interrupted by restart"), interrupted)
+        query = "UPDATE payments SET status='interrupted' WHERE status='running'"
+        sql_db(query)
+    # parked payments were waiting on funds and never marked paid, so are safe to retry
+    query = "UPDATE payments SET status='queued' WHERE status='parked'"
+    sql_db(query)
+    payment_load()
+    for _ in range(PAYMENT_WORKERS):
+        Thread(target=payment_worker, args=(target, keys), daemon=True).start()
+    Thread(target=payment_loader, daemon=True).start()
+
+
+def payment_stats():
+    """
+    :return dict(): queue depth, jobs running, and queue wait and run latency in ms
+    """
+    with PAYMENTS["condition"]:
+        stats = PAYMENTS["stats"]
+        done = max(stats["done"], 1)
+        return {
+            "queued": len(PAYMENTS["queue"]),
+            "running": len(PAYMENTS["running"]) - len(PAYMENTS["parked"]),
+            "parked": len(PAYMENTS["parked"]),
+            "done": stats["done"],
+            "failed": stats["failed"],
+            "wait_avg": int(stats["wait"] / done),
+            "wait_max": stats["wait_max"],
+            "run_avg": int(stats["run"] / done),
+        }
@@ -0,0 +1,115 @@
+"""
+BitShares.org StakeMachine
+Write Behind Receipt Journal
+receipts are buffered in memory and group committed by one journal thread
+BitShares Management Group Co. Ltd.
+"""
+
+# DISABLE SELECT PYLINT TESTS
+# pylint: disable=broad-except
+
+# STANDARD PYTHON MODULES
+import atexit
+import time
+from threading import Condition, Thread
+
+# STAKE BTS MODULES
+from config import RECEIPT_BATCH, RECEIPT_FLUSH
+from utilities import exception_handler, line_info, munix, sql_db
+
+# receipts awaiting commit, counted by sequence number as appended and committed
+JOURNAL = {
+    "buffer": [],
+    "appended": 0,
+    "committed": 0,
+    "condition": Condition(),
+    "thread": None,
+    "flushes": 0,
+    "latency": 0.0,
+    "latency_max": 0.0,
+}
+
+
+def journal_append(nonce, msg):
+    """
+    buffer a receipt, committed within RECEIPT_FLUSH seconds
+    :param int(nonce): *start* munix timestamp associated with this stake
+    :param str(msg): auditable event documentation
+    :return int(): sequence number of this receipt
+    """
+    with JOURNAL["condition"]:
+        JOURNAL["buffer"].append((nonce, munix(), msg))
+        JOURNAL["appended"] += 1
+        if JOURNAL["thread"] is None:
+            JOURNAL["thread"] = Thread(target=journal_writer, daemon=True)
+            JOURNAL["thread"].start()
+        # wake the writer to start the RECEIPT_FLUSH timer, or to commit a full batch
+        if len(JOURNAL["buffer"]) in (1, RECEIPT_BATCH):
+            JOURNAL["condition"].notify_all()
+        return JOURNAL["appended"]
+
+
+def journal_flush():
+    """
+    SECURITY - barrier, block until every receipt appended so far is committed
+    :return None:
+    """
+    with JOURNAL["condition"]:
+        target = JOURNAL["appended"]
+        if JOURNAL["thread"] is None:
+            return
+        JOURNAL["condition"].notify_all()
+        while JOURNAL["committed"] < target:
+            JOURNAL["condition"].wait()
+
+
+def journal_writer():
+    """
+    the journal thread, commits the buffer every RECEIPT_FLUSH seconds,
+    sooner once RECEIPT_BATCH receipts are waiting or a flush is requested
+    """
+    query = "INSERT INTO receipts (nonce, now, msg) VALUES (?,?,?)"
+    while True:
+        with JOURNAL["condition"]:
+            while not JOURNAL["buffer"]:
+                JOURNAL["condition"].wait()
+            JOURNAL["condition"].wait(RECEIPT_FLUSH)
+            batch, JOURNAL["buffer"] = JOURNAL["buffer"], []
+            sequence = JOURNAL["appended"]
+        begin = time.time()
+        try:
+            # one transaction for the whole batch
+            sql_db([{"query": query, "values": batch, "many": True}])
+        except Exception as error:
+            print(exception_handler(error), line_info())
+            # put the batch back in order and try again
+            with JOURNAL["condition"]:
+                JOURNAL["buffer"][:0] = batch
+            time.sleep(1)
+            continue
+        latency = time.time() - begin
+        with JOURNAL["condition"]:
+            JOURNAL["committed"] = sequence
+            JOURNAL["flushes"] += 1
+            JOURNAL["latency"] += latency
+            JOURNAL["latency_max"] = max(JOURNAL["latency_max"], latency)
+            JOURNAL["condition"].notify_all()
+
+
+def journal_stats():
+    """
+    :return dict(): receipts pending and committed, flush count and latency in ms
+    """
+    with JOURNAL["condition"]:
+        flushes = JOURNAL["flushes"]
+        return {
+            "pending": JOURNAL["appended"] - JOURNAL["committed"],
+            "committed": JOURNAL["committed"],
+            "flushes": flushes,
+            "rows_per_flush": round(JOURNAL["committed"] / max(flushes, 1), 1),
+            "latency_avg_ms": round(1000 * JOURNAL["latency"] / max(flushes, 1), 1),
+            "latency_max_ms": round(1000 * JOURNAL["latency_max"], 1),
+        }
+
+
+atexit.register(journal_flush)
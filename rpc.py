@@ -7,27 +7,83 @@ BitShares Management Group Co. Ltd.
 # pylint: disable=broad-except
 
 # STANDARD PYTHON MODULES
+import atexit
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+from contextlib import contextmanager
 from json import dumps as json_dumps
+from threading import Condition, Event, Lock, RLock, Thread, local
+from uuid import NAMESPACE_URL, uuid4, uuid5
 
 # PYBITSHARES MODULES
 from bitshares.account import Account
+from bitshares.asset import Asset
 from bitshares.bitshares import BitShares
 from bitshares.instance import set_shared_bitshares_instance
 from bitshares.memo import Memo
+from grapheneapi.exceptions import RPCError
 
 # BITTREX MODULES
 from bittrex_api import Bittrex
 # STAKE BTS MODULES
-from config import BROKER, DEV, NODE
-from utilities import exception_handler, it, line_info
+from config import (ACCOUNT_CACHE_SIZE, ACCOUNT_CACHE_TTL, ASSET_CACHE_TTL,
+                    BALANCE_TIMEOUT, BALANCE_TTL, BLOCK_INTERVAL, BLOCK_WINDOW,
+                    BROKER, DEV, HEIGHT_STALE, HISTORY_PAGE, NODE,
+                    NODE_HEALTH_CHECK, NODE_POOL_SIZE, PAYMENT_WORKERS,
+                    PAYOUT_BATCH_SIZE, PAYOUT_BATCH_WINDOW, SIGNER_IDLE,
+                    WITHDRAWAL_EXPIRE, WITHDRAWAL_PAGES, WITHDRAWAL_POLL,
+                    WITHDRAWAL_RETRIES, WITHDRAWAL_SETTLE)
+from logger import log
+from metrics import timed
+from utilities import LRUCache, exception_handler, it, line_info, munix, sql_db
 
 NINES = 999999999
+# idle node connections shared by all threads, and the connection each thread holds
+POOL = {"idle": [], "lock": Lock(), "held": local()}
+# bittrex clients for corporate api accounts 1, 2 and 3, keyed by api number and key
+# and a dedicated balance thread per account, with its balance request in flight
+BITTREX = {
+    "clients": {},
+    "lock": Lock(),
+    "executors": {api: ThreadPoolExecutor(1) for api in range(1, 4)},
+    "balances": {},
+}
+# cached broker and bittrex balances, and broker funds reserved by payouts in flight
+BALANCES = {
+    "broker": 0,
+    "broker_fetched": 0,
+    "broker_block": NINES,
+    "reserved": 0,
+    "bittrex": {},
+    "failed": {},
+    "bittrex_fetched": 0,
+    "lock": RLock(),
+}
+# head and irreversible block numbers, polled once per block by height_tracker()
+HEIGHT = {
+    "head": 0,
+    "irreversible": 0,
+    "updated": 0,
+    "condition": Condition(),
+    "thread": None,
+}
+# in memory signer holding the broker's active and memo keys between unlocks
+SIGNER = {"bitshares": None, "memo": None, "used": 0, "lock": RLock(), "timer": None}
+# account lookups by name or 1.2.x id, and asset precision by 1.3.x id
+ACCOUNTS = LRUCache(ACCOUNT_CACHE_SIZE, ACCOUNT_CACHE_TTL)
+ASSETS = LRUCache(100, ASSET_CACHE_TTL)
+# payouts gathered during PAYOUT_BATCH_WINDOW, flushed by the first caller to arrive
+BATCH = {"pending": [], "condition": Condition(), "leader": False}
+# bittrex withdrawals by id until they close, and conditions notified when they do
+WITHDRAWALS = {"tracked": {}, "listeners": [], "condition": Condition(), "thread": None}
 
 # CONNECT WALLET TO BITSHARES NODE
 def pybitshares_reconnect():
     """
     create locked owner and memo instances of the pybitshares wallet
+    NOTE: opens a new websocket, prefer the pooled pybitshares_connection()
     :return: two pybitshares instances
     """
     pause = 0
@@ -45,48 +101,438 @@ def pybitshares_reconnect():
             continue
 
 
+# PERSISTENT NODE CONNECTION POOL
+def pybitshares_checkout():
+    """
+    borrow an idle connection from the pool, pinging it if it has sat idle a while
+    connect anew when the pool is empty or every idle connection is dead
+    :return dict(conn): with keys ["bitshares", "memo", "used", "failed"]
+    """
+    while True:
+        with POOL["lock"]:
+            conn = POOL["idle"].pop() if POOL["idle"] else None
+        if conn is None:
+            bitshares, memo = pybitshares_reconnect()
+            return {"bitshares": bitshares, "memo": memo, "used": 0, "failed": False}
+        if time.time() - conn["used"] < NODE_HEALTH_CHECK:
+            return conn
+        try:
+            conn["bitshares"].rpc.get_dynamic_global_properties()
+            return conn
+        except Exception as error:
+            print(exception_handler(error), line_info())
+
+
+def pybitshares_checkin(conn):
+    """
+    return a connection to the pool, close it if the pool is full or it has died
+    a connection flagged as failed is pinged and only pooled again if it responds
+    :param dict(conn): connection previously taken with pybitshares_checkout()
+    :return None:
+    """
+    healthy = True
+    if conn["failed"]:
+        try:
+            conn["bitshares"].rpc.get_dynamic_global_properties()
+            conn["failed"] = False
+        except Exception as error:
+            print(exception_handler(error), line_info())
+            healthy = False
+    conn["used"] = time.time()
+    if healthy:
+        with POOL["lock"]:
+            if len(POOL["idle"]) < NODE_POOL_SIZE:
+                POOL["idle"].append(conn)
+                return
+    try:
+        conn["bitshares"].rpc.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def pybitshares_connection():
+    """
+    thread safe access to a persistent pooled node connection, usage:
+        with pybitshares_connection() as (bitshares, memo):
+    reentrant; nested use within one thread shares the connection held by the thread
+    a connection which raises is health checked and discarded if dead,
+    so the next checkout reconnects
+    :yield tuple(bitshares, memo): pybitshares instances bound to the connection
+    """
+    held = POOL["held"]
+    outer = getattr(held, "conn", None) is None
+    if outer:
+        held.conn = pybitshares_checkout()
+    conn = held.conn
+    try:
+        yield conn["bitshares"], conn["memo"]
+    except Exception:
+        conn["failed"] = True
+        raise
+    finally:
+        if outer:
+            held.conn = None
+            pybitshares_checkin(conn)
+
+
+# SIGNER SESSION
+def signer_unlock(keys):
+    """
+    unlock the wallet once and copy the broker's active and memo private keys
+    into a dedicated in memory signer, so later operations skip key derivation
+    :param dict(keys): contains pybitshares wallet password for corporate account
+    :return None:
+    """
+    with pybitshares_connection() as (bitshares, _):
+        account = Account(keys["broker"], blockchain_instance=bitshares)
+        public_keys = [i[0] for i in account["active"]["key_auths"]]
+        public_keys.append(account["options"]["memo_key"])
+        bitshares.wallet.unlock(keys["password"])
+        try:
+            wifs = []
+            for public_key in public_keys:
+                try:
+                    wifs.append(bitshares.wallet.getPrivateKeyForPublicKey(public_key))
+                except Exception:
+                    pass  # wallet holds no private key for this public key
+        finally:
+            bitshares.wallet.lock()
+    signer = BitShares(node=NODE, keys=wifs, nobroadcast=False)
+    SIGNER.update({"bitshares": signer, "memo": Memo(blockchain_instance=signer)})
+    if SIGNER["timer"] is None:
+        SIGNER["timer"] = Thread(target=signer_expire, daemon=True)
+        SIGNER["timer"].start()
+    print(it("purple", "SIGNER UNLOCKED"))
+
+
+def signer_lock():
+    """
+    wipe the in memory signing keys and disconnect the signer
+    NOTE python strings cannot be overwritten, wiping is best effort
+    :return None:
+    """
+    with SIGNER["lock"]:
+        signer = SIGNER["bitshares"]
+        SIGNER.update({"bitshares": None, "memo": None})
+        if signer is None:
+            return
+        try:
+            signer.wallet.store.wipe()
+            signer.rpc.close()
+        except Exception:
+            pass
+        print(it("purple", "SIGNER LOCKED"))
+
+
+def signer_expire():
+    """
+    wipe the signing keys once they have sat idle for SIGNER_IDLE seconds
+    :return None:
+    """
+    while True:
+        time.sleep(min(SIGNER_IDLE, 60))
+        with SIGNER["lock"]:
+            if SIGNER["bitshares"] and time.time() - SIGNER["used"] > SIGNER_IDLE:
+                signer_lock()
+
+
+@contextmanager
+def signer_session(keys):
+    """
+    serialized access to the in memory signer, unlocking the wallet only on
+    first use or after expiry, usage:
+        with signer_session(keys) as (bitshares, memo):
+    a signer which raises is health checked and locked if its connection is dead
+    :param dict(keys): contains pybitshares wallet password for corporate account
+    :yield tuple(bitshares, memo): pybitshares instances holding the broker's keys
+    """
+    with SIGNER["lock"]:
+        if SIGNER["bitshares"] is None:
+            signer_unlock(keys)
+        try:
+            yield SIGNER["bitshares"], SIGNER["memo"]
+        except Exception:
+            try:
+                SIGNER["bitshares"].rpc.get_dynamic_global_properties()
+            except Exception:
+                signer_lock()
+            raise
+        finally:
+            SIGNER["used"] = time.time()
+
+
+def signer_memo_wif(keys):
+    """
+    the broker's memo private key, for memo decryption in other processes
+    :param dict(keys): contains pybitshares wallet password for corporate account
+    :return str(wif):
+    """
+    with signer_session(keys) as (bitshares, _):
+        account = Account(keys["broker"], blockchain_instance=bitshares)
+        return bitshares.wallet.getPrivateKeyForPublicKey(
+            account["options"]["memo_key"]
+        )
+
+
+atexit.register(signer_lock)
+
+
+# CACHED OBJECT ID RESOLUTION
+def fetch_account(identifier):
+    """
+    :param str(identifier): account name or 1.2.x id
+    :return dict(): the account's "id", "name" and lifetime member status "ltm"
+    """
+    with pybitshares_connection() as (bitshares, _):
+        account = Account(identifier, blockchain_instance=bitshares)
+        return {"id": account["id"], "name": account["name"], "ltm": account.is_ltm}
+
+
+def fetch_asset_precision(asset_id):
+    """
+    :param str(asset_id): 1.3.x asset id
+    :return int(): number of decimal places of the asset
+    """
+    with pybitshares_connection() as (bitshares, _):
+        return int(Asset(asset_id, blockchain_instance=bitshares).precision)
+
+
+def get_account(identifier):
+    """
+    :param str(identifier): account name or 1.2.x id
+    :return dict(): cached account "id", "name" and "ltm"
+    """
+    return ACCOUNTS.get(identifier, fetch_account)
+
+
+def get_asset_precision(asset_id):
+    """
+    :param str(asset_id): 1.3.x asset id
+    :return int(): cached number of decimal places of the asset
+    """
+    return ASSETS.get(asset_id, fetch_asset_precision)
+
+
+def cache_stats():
+    """
+    :return dict(): hit/miss counters of the object id resolution caches
+    """
+    return {"accounts": ACCOUNTS.stats(), "assets": ASSETS.stats()}
+
+
+# BITTREX CLIENT REGISTRY
+def get_bittrex(api, keys):
+    """
+    reuse one keep alive bittrex client per corporate api account
+    :param int(api): 1, 2, or 3; corporate account
+    :param dict(keys): api keys and secrets for bittrex accounts
+    :return object(Bittrex): client with a persistent pooled http session
+    """
+    key = (api, keys[f"api_{api}_key"])
+    with BITTREX["lock"]:
+        if key not in BITTREX["clients"]:
+            # replace any client built from keys entered at an earlier login attempt
+            for stale in [i for i in BITTREX["clients"] if i[0] == api]:
+                BITTREX["clients"].pop(stale).close()
+            BITTREX["clients"][key] = Bittrex(
+                api_key=keys[f"api_{api}_key"], api_secret=keys[f"api_{api}_secret"]
+            )
+        return BITTREX["clients"][key]
+
+
 # RPC BLOCK NUMBER
+def fetch_block_height():
+    """
+    connect to node, get the head and irreversible block numbers and cache them
+    :return None:
+    """
+    with pybitshares_connection() as (bitshares, _):
+        dgp = bitshares.rpc.get_dynamic_global_properties()
+    with HEIGHT["condition"]:
+        HEIGHT["head"] = dgp["head_block_number"]
+        HEIGHT["irreversible"] = dgp["last_irreversible_block_num"]
+        HEIGHT["updated"] = time.time()
+        HEIGHT["condition"].notify_all()
+
+
+def height_tracker():
+    """
+    poll the block height once per BLOCK_INTERVAL
+    """
+    while True:
+        try:
+            fetch_block_height()
+        except Exception as error:
+            print(exception_handler(error), line_info())
+        time.sleep(BLOCK_INTERVAL)
+
+
+def get_block_height():
+    """
+    the cached block height, fetched directly if older than HEIGHT_STALE seconds
+    :return tuple(int(irreversible), int(head), float(updated)):
+        block numbers and the unix time they were fetched
+    """
+    with HEIGHT["condition"]:
+        if HEIGHT["thread"] is None:
+            HEIGHT["thread"] = Thread(target=height_tracker, daemon=True)
+            HEIGHT["thread"].start()
+        stale = time.time() - HEIGHT["updated"] > HEIGHT_STALE
+    if stale:
+        fetch_block_height()
+    with HEIGHT["condition"]:
+        return HEIGHT["irreversible"], HEIGHT["head"], HEIGHT["updated"]
+
+
 def get_block_num_current():
     """
-    connect to node and get the irreversible block number
+    the irreversible block number, from the cached block height
     :return int(): block number
     """
-    bitshares, _ = pybitshares_reconnect()
-    return bitshares.rpc.get_dynamic_global_properties()["last_irreversible_block_num"]
+    return get_block_height()[0]
+
+
+# RPC BLOCKS
+@timed("stake_block_fetch_seconds")
+def get_block(block_num):
+    """
+    fetch a single block from the node, retrying until it arrives
+    :param int(block_num): block number to fetch
+    :return dict(): block data
+    """
+    pause = 0
+    while True:
+        try:
+            with pybitshares_connection() as (bitshares, _):
+                block = bitshares.rpc.get_block(block_num)
+            if block is None:
+                raise ValueError(f"Block {block_num} Not Found")
+            return block
+        except Exception as error:
+            print(exception_handler(error), line_info())
+            time.sleep(0.1 * 2 ** pause)
+            if pause < 13:  # oddly works out to about 13 minutes
+                pause += 1
+            continue
+
+
+def get_blocks(block_first, block_last):
+    """
+    prefetch a range of blocks concurrently, BLOCK_WINDOW requests in flight
+    blocks are yielded strictly in ascending order regardless of arrival order
+    :param int(block_first): first block number to fetch
+    :param int(block_last): last block number to fetch, inclusive
+    :yield tuple(int(block_num), dict(block)):
+    """
+    with ThreadPoolExecutor(max_workers=BLOCK_WINDOW) as executor:
+        in_flight = deque()
+        block_next = block_first
+        while in_flight or block_next <= block_last:
+            while block_next <= block_last and len(in_flight) < BLOCK_WINDOW:
+                in_flight.append((block_next, executor.submit(get_block, block_next)))
+                block_next += 1
+            block_num, future = in_flight.popleft()
+            yield block_num, future.result()
+
+
+def get_broker_blocks(block_first, block_last):
+    """
+    page back through the broker's account history, newest first, collecting
+    BTS transfers to the broker; blocks without such transfers are never fetched
+    yields the same block format as get_blocks(), pruned to the relevant operations
+    :param int(block_first): first block number to search
+    :param int(block_last): last block number to search, inclusive
+    :yield tuple(int(block_num), dict(block)): in ascending chain order
+    """
+    history = []
+    broker_id = get_account(BROKER)["id"]
+    with pybitshares_connection() as (bitshares, _):
+        start = "1.11.0"  # most recent operation
+        while True:
+            page = bitshares.rpc.get_account_history(
+                broker_id, "1.11.0", HISTORY_PAGE, start, api="history"
+            )
+            history += [i for i in page if block_first <= i["block_num"] <= block_last]
+            oldest = int(page[-1]["id"].split(".")[2]) if page else 0
+            if (
+                len(page) < HISTORY_PAGE
+                or page[-1]["block_num"] < block_first
+                or oldest <= 1
+            ):
+                break
+            start = f"1.11.{oldest - 1}"
+    if page and page[-1]["block_num"] > block_first:
+        print(
+            it("red", f"WARN account history begins after block {block_first}"),
+            line_info(),
+        )
+    # group transfers to the broker by block, ascending operation id is chain order
+    blocks = {}
+    for item in sorted(history, key=lambda i: int(i["id"].split(".")[2])):
+        if item["op"][0] == 0 and item["op"][1]["to"] == broker_id:
+            blocks.setdefault(item["block_num"], []).append(item["op"])
+    for block_num, operations in sorted(blocks.items()):
+        yield block_num, {"transactions": [{"operations": operations}]}
 
 
 # RPC POST WITHDRAWALS
-def post_withdrawal_bittrex(amount, client, api, keys):
+@timed("stake_withdrawal_bittrex_seconds")
+def post_withdrawal_bittrex(amount, client, api, keys, key=None):
     """
     send funds using the bittrex api
+    idempotent, the withdrawal is claimed in the local ledger before it is sent
     :param int(amount): quantity to be withdrawn
     :param str(client): bitshares username to send to
     :param dict(keys): api keys and secrets for bittrex accounts
     :param int(api): 1, 2, or 3; corporate account to send from
+    :param str(key): deterministic identity of this withdrawal, eg. from a nonce,
+        a withdrawal already sent with the same key is never sent again
     :return str(msg): withdrawal response from bittrex
     """
     amount = int(amount)
-    msg = f"POST WITHDRAWAL BITTREX {amount} {client} {api}, response: "
+    key = key or str(uuid4())
+    msg = f"POST WITHDRAWAL BITTREX {amount} {client} {api} {key}, response: "
     print(it("yellow", msg))
     if not DEV:
         try:
             if amount <= 0:
                 raise ValueError(f"Invalid Withdrawal Amount {amount}")
-            bittrex_api = Bittrex(
-                api_key=keys[f"api_{api}_key"], api_secret=keys[f"api_{api}_secret"]
-            )
+            client_withdrawal_id = withdrawal_ledger(key, amount, client, api)
+            if client_withdrawal_id is None:
+                msg += "duplicate, this withdrawal was already sent"
+                print(it("yellow", msg))
+                return msg
+            bittrex_api = get_bittrex(api, keys)
             params = {
                 "currencySymbol": "BTS",
                 "quantity": str(float(amount)),
                 "cryptoAddress": str(client),
+                "clientWithdrawalId": client_withdrawal_id,
             }
             # returns response.json() as dict or list python object
-            ret = bittrex_api.post_withdrawal(**params)
+            # safe to resend, bittrex will not repeat a clientWithdrawalId
+            for attempt in range(WITHDRAWAL_RETRIES + 1):
+                try:
+                    ret = bittrex_api.post_withdrawal(**params)
+                    break
+                except Exception as error:
+                    if attempt == WITHDRAWAL_RETRIES:
+                        raise
+                    print(exception_handler(error), line_info())
+                    time.sleep(2 ** attempt)
             msg += json_dumps(ret)
             if isinstance(ret, dict):
                 if "code" in ret:
                     print(it("red", ret), line_info())
+                    # the clientWithdrawalId was already used, ie. this was sent
+                    duplicate = "EXISTS" in ret["code"] or "DUPLICATE" in ret["code"]
+                    status = "sent" if duplicate else "failed"
+                    withdrawal_record(client_withdrawal_id, status, ret)
                     raise TypeError("Bittrex failed with response code")
+            withdrawal_record(client_withdrawal_id, "sent", ret)
+            balance_bittrex_adjust(api, -amount)
+            withdrawal_track(api, ret, keys)
         except Exception as error:
             msg += line_info() + " " + exception_handler(error)
             msg += it("red", f"bittrex failed to send {amount} to client {client}",)
@@ -94,6 +540,7 @@ def post_withdrawal_bittrex(amount, client, api, keys):
     return msg
 
 
+@timed("stake_withdrawal_pybitshares_seconds")
 def post_withdrawal_pybitshares(amount, client, memo, keys):
     """
     send BTS with memo to confirm new stake from pybitshares wallet
@@ -105,18 +552,19 @@ def post_withdrawal_pybitshares(amount, client, memo, keys):
     """
     amount = int(amount)
     msg = f"POST WITHDRAWAL PYBITSHARES {amount} {client} {memo}, response: "
-    print(it("yellow", msg))
+    log("INFO", "post withdrawal pybitshares", amount=amount, client=client)
     if not DEV:
         try:
             if amount <= 0:
                 raise ValueError(f"Invalid Withdrawal Amount {amount}")
-            bitshares, _ = pybitshares_reconnect()
-            bitshares.wallet.unlock(keys["password"])
-            msg += json_dumps(
-                bitshares.transfer(client, amount, "BTS", memo, account=keys["broker"])
-            )  # returns dict
-            bitshares.wallet.lock()
-            bitshares.clear_cache()
+            with signer_session(keys) as (bitshares, _):
+                msg += json_dumps(
+                    bitshares.transfer(
+                        client, amount, "BTS", memo, account=keys["broker"]
+                    )
+                )  # returns dict
+                bitshares.clear_cache()
+            balance_adjust(-amount)
         except Exception as error:
             msg += line_info() + " " + exception_handler(error)
             msg += it(
@@ -128,38 +576,410 @@ def post_withdrawal_pybitshares(amount, client, memo, keys):
     return msg
 
 
-# RPC GET BALANCES
-def get_balance_bittrex(keys):
+@timed("stake_withdrawals_pybitshares_seconds")
+def post_withdrawals_pybitshares(transfers, keys):
     """
-    get bittrex BTS balances for all three corporate accounts
-    :param keys: dict containing api keys and secrets for 3 accounts
-    :return dict(balances):format {1: 0, 2: 0, 3: 0} with int() BTS balance for each api
+    send several BTS transfers, each with its own memo, in one signed transaction
+    :param list(transfers): dicts with keys ["amount", "client", "memo"]
+    :param dict(keys): contains pybitshares wallet password for corporate account
+    :return list(str(msg)): withdrawal response for each transfer, in order
     """
-    balances = {1: NINES, 2: NINES, 3: NINES}
+    msgs = [
+        f"POST WITHDRAWAL PYBITSHARES {i['amount']} {i['client']} {i['memo']}, "
+        + f"batch of {len(transfers)}, response: "
+        for i in transfers
+    ]
+    log("INFO", "post withdrawals pybitshares", batch=len(transfers))
     if not DEV:
-        for api in range(1, 4):
-            balance = 0
-            try:
-                bittrex_api = Bittrex(
-                    api_key=keys[f"api_{api}_key"], api_secret=keys[f"api_{api}_secret"]
+        broadcast = False
+        try:
+            for transfer in transfers:
+                if int(transfer["amount"]) <= 0:
+                    raise ValueError(f"Invalid Withdrawal Amount {transfer['amount']}")
+            with signer_session(keys) as (bitshares, _):
+                trx = bitshares.new_tx()
+                for transfer in transfers:
+                    bitshares.transfer(
+                        transfer["client"],
+                        int(transfer["amount"]),
+                        "BTS",
+                        transfer["memo"],
+                        account=keys["broker"],
+                        append_to=trx,
+                    )
+                # from here on the batch may have reached the node
+                broadcast = True
+                response = json_dumps(trx.broadcast())  # returns dict
+                bitshares.clear_cache()
+            balance_adjust(-sum(int(i["amount"]) for i in transfers))
+            msgs = [msg + response for msg in msgs]
+        except Exception as error:
+            reason = line_info() + " " + exception_handler(error)
+            msgs = [
+                msg
+                + reason
+                + it(
+                    "red",
+                    f"pybitshares failed to send batch of {len(transfers)} transfers, ",
                 )
-                # returns list() on success or dict() on error
-                ret = bittrex_api.get_balances()
-                if isinstance(ret, dict):
-                    print(it("red", ret), line_info())
-                # ret balance will be strigified float; int(float(()) to return integer
-                balance = int(
-                    float(
-                        [i for i in ret if i["currencySymbol"] == "BTS"][0]["available"]
+                for msg in msgs
+            ]
+            log("ERROR", "post withdrawals pybitshares failed", msg=msgs[0])
+            # SECURITY - these payouts are already marked paid; when the batch was
+            # certainly not sent, ie. never broadcast or rejected by the node,
+            # send each transfer alone so one bad transfer fails only itself
+            if len(transfers) > 1 and (not broadcast or isinstance(error, RPCError)):
+                msgs = [
+                    msg
+                    + "sending individually, "
+                    + post_withdrawal_pybitshares(
+                        transfer["amount"], transfer["client"], transfer["memo"], keys
+                    )
+                    for msg, transfer in zip(msgs, transfers)
+                ]
+    return msgs
+
+
+def post_withdrawal_batched(amount, client, memo, keys):
+    """
+    drop in for post_withdrawal_pybitshares() which gathers concurrent payouts
+    for up to PAYOUT_BATCH_WINDOW seconds and broadcasts them as few transactions
+    the first caller of each window sends the whole batch, early once it is full,
+    every caller blocks until its own transfer has been broadcast
+    NOTE every caller holds its payment worker meanwhile, so a batch is full at
+    PAYMENT_WORKERS transfers, and the window only delays payouts when few are due
+    :param int(amount): quantity to be withdrawn
+    :param str(client): bitshares username to send to
+    :param str(memo): message to client
+    :param dict(keys): contains pybitshares wallet password for corporate account
+    :return str(msg): withdrawal response for this transfer
+    """
+    if not PAYOUT_BATCH_WINDOW:
+        return post_withdrawal_pybitshares(amount, client, memo, keys)
+    full = min(PAYOUT_BATCH_SIZE, PAYMENT_WORKERS)
+    transfer = {"amount": amount, "client": client, "memo": memo, "sent": Event()}
+    with BATCH["condition"]:
+        BATCH["pending"].append(transfer)
+        leader = not BATCH["leader"]
+        BATCH["leader"] = True
+        if len(BATCH["pending"]) >= full:
+            BATCH["condition"].notify_all()
+    if leader:
+        deadline = time.time() + PAYOUT_BATCH_WINDOW
+        with BATCH["condition"]:
+            while len(BATCH["pending"]) < full and time.time() < deadline:
+                BATCH["condition"].wait(deadline - time.time())
+            batch, BATCH["pending"], BATCH["leader"] = BATCH["pending"], [], False
+        try:
+            for begin in range(0, len(batch), PAYOUT_BATCH_SIZE):
+                chunk = batch[begin : begin + PAYOUT_BATCH_SIZE]
+                for item, msg in zip(chunk, post_withdrawals_pybitshares(chunk, keys)):
+                    item["msg"] = msg
+                    item["sent"].set()
+        finally:
+            # never leave a caller waiting on a batch which raised
+            for item in batch:
+                if not item["sent"].is_set():
+                    item["msg"] = it(
+                        "red",
+                        f"POST WITHDRAWAL PYBITSHARES {item['amount']} "
+                        + f"{item['client']} {item['memo']}, batch failed, "
+                        + "status unknown, see logs",
                     )
+                    item["sent"].set()
+    transfer["sent"].wait()
+    return transfer["msg"]
+
+
+# BITTREX WITHDRAWAL LEDGER
+def withdrawal_ledger(key, amount, client, api):
+    """
+    claim the clientWithdrawalId of a withdrawal in the database before it is sent
+    the id is a uuid5 of the key and attempt number, so resending a withdrawal
+    whose outcome is unknown reuses its id, and bittrex will not send it twice
+    :param str(key): deterministic identity of this withdrawal
+    :param int(amount): quantity to be withdrawn
+    :param str(client): bitshares username to send to
+    :param int(api): 1, 2, or 3; corporate account to send from
+    :return str(uuid): clientWithdrawalId, None if this key was already sent
+    """
+    query = "SELECT id, status FROM withdrawals WHERE key=? ORDER BY attempt"
+    rows = sql_db(query, (key,))
+    if any(row[1] == "sent" for row in rows):
+        return None
+    # pending means a crash or timeout, it may have been sent, so resend the same id
+    if rows and rows[-1][1] == "pending":
+        return rows[-1][0]
+    # the first attempt, or a retry after bittrex failed or cancelled the last one
+    attempt = len(rows)
+    client_withdrawal_id = str(uuid5(NAMESPACE_URL, f"stakebts:{key}:{attempt}"))
+    query = (
+        "INSERT OR IGNORE INTO withdrawals "
+        + "(id, key, attempt, api, client, amount, status, created, updated) "
+        + "VALUES (?,?,?,?,?,?,'pending',?,?)"
+    )
+    now = munix()
+    values = (client_withdrawal_id, key, attempt, api, client, amount, now, now)
+    sql_db(query, values)
+    return client_withdrawal_id
+
+
+def withdrawal_record(client_withdrawal_id, status, ret):
+    """
+    update the ledger with the outcome of a withdrawal
+    :param str(client_withdrawal_id): ledger id
+    :param str(status): "sent", "failed" or "cancelled"
+    :param dict(ret): bittrex response
+    :return None:
+    """
+    withdrawal_id = ret.get("id") if isinstance(ret, dict) else None
+    query = (
+        "UPDATE withdrawals SET status=?, withdrawal_id=?, updated=?, response=? "
+        + "WHERE id=?"
+    )
+    values = (status, withdrawal_id, munix(), json_dumps(ret), client_withdrawal_id)
+    sql_db(query, values)
+
+
+def withdrawals_reconcile(keys):
+    """
+    on startup, resolve withdrawals left pending by a crash or timeout
+    bittrex is asked for each by its clientWithdrawalId
+    :param dict(keys): api keys and secrets for bittrex accounts
+    :return None:
+    """
+    query = "SELECT id, api FROM withdrawals WHERE status='pending'"
+    for client_withdrawal_id, api in sql_db(query):
+        try:
+            bittrex_api = get_bittrex(api, keys)
+            ret = bittrex_api.get_withdrawal_by_client_id(client_withdrawal_id)
+            if isinstance(ret, dict) and ret.get("id"):
+                withdrawal_record(client_withdrawal_id, "sent", ret)
+                withdrawal_track(api, ret, keys)
+            elif isinstance(ret, dict) and ret.get("code") == "NOT_FOUND":
+                # never reached bittrex, a retry will make a new attempt
+                withdrawal_record(client_withdrawal_id, "failed", ret)
+            print(it("yellow", f"reconciled withdrawal {client_withdrawal_id}"), ret)
+        except Exception as error:
+            print(exception_handler(error), line_info())
+
+
+# BITTREX WITHDRAWAL TRACKER
+def withdrawal_track(api, ret, keys):
+    """
+    follow a bittrex withdrawal by its id until it closes
+    :param int(api): 1, 2, or 3; corporate account it was sent from
+    :param dict(ret): response of Bittrex.post_withdrawal()
+    :param dict(keys): api keys and secrets for bittrex accounts
+    :return None:
+    """
+    if isinstance(ret, dict) and ret.get("id"):
+        with WITHDRAWALS["condition"]:
+            WITHDRAWALS["tracked"][ret["id"]] = {
+                "api": api,
+                "address": ret.get("cryptoAddress"),
+                "quantity": float(ret.get("quantity", 0)),
+                "status": ret.get("status", "REQUESTED"),
+                "txId": ret.get("txId"),
+                "issued": time.time(),
+                "completed": 0,
+            }
+            if WITHDRAWALS["thread"] is None:
+                WITHDRAWALS["thread"] = Thread(
+                    target=withdrawal_tracker, args=(keys,), daemon=True
                 )
+                WITHDRAWALS["thread"].start()
+            WITHDRAWALS["condition"].notify_all()
+
+
+def withdrawal_listen(condition):
+    """
+    register a threading.Condition to be notified whenever a withdrawal closes
+    """
+    with WITHDRAWALS["condition"]:
+        if condition not in WITHDRAWALS["listeners"]:
+            WITHDRAWALS["listeners"].append(condition)
+
+
+def withdrawals_in_transit():
+    """
+    BTS withdrawn from bittrex to the broker which may not yet show in its balance
+    completed withdrawals count for WITHDRAWAL_SETTLE seconds, until seen on chain
+    withdrawals elsewhere, eg. admin bittrex_to_bmg, are never cover
+    :return float(): total quantity in transit
+    """
+    now = time.time()
+    with WITHDRAWALS["condition"]:
+        return sum(
+            i["quantity"]
+            for i in WITHDRAWALS["tracked"].values()
+            if i["address"] == BROKER
+            and (not i["completed"] or now - i["completed"] < WITHDRAWAL_SETTLE)
+        )
+
+
+def withdrawals_status(api, ids, keys):
+    """
+    bulk status of withdrawals from one bittrex account
+    searches open withdrawals, then pages through closed withdrawals newest first
+    :param int(api): 1, 2, or 3; corporate account
+    :param set(ids): withdrawal ids to find
+    :param dict(keys): api keys and secrets for bittrex accounts
+    :return dict(): {id: withdrawal} for each id found
+    """
+    bittrex_api = get_bittrex(api, keys)
+    found = {}
+    ret = bittrex_api.get_withdrawals_open(currencySymbol="BTS")
+    if isinstance(ret, list):
+        found.update({i["id"]: i for i in ret if i.get("id") in ids})
+    params = {"currencySymbol": "BTS", "pageSize": 200}
+    for _ in range(WITHDRAWAL_PAGES):
+        if ids.issubset(found):
+            break
+        ret = bittrex_api.get_withdrawals_closed(**params)
+        if not isinstance(ret, list):
+            break
+        found.update({i["id"]: i for i in ret if i.get("id") in ids})
+        if len(ret) < params["pageSize"]:
+            break
+        params["nextPageToken"] = ret[-1]["id"]
+    return found
+
+
+def withdrawal_tracker(keys):
+    """
+    poll the status of tracked withdrawals in bulk, one query per bittrex account
+    notify listeners as soon as a withdrawal completes with an on chain txId
+    or otherwise closes, ie. is cancelled or rejected
+    :param dict(keys): api keys and secrets for bittrex accounts
+    """
+    while True:
+        with WITHDRAWALS["condition"]:
+            while not WITHDRAWALS["tracked"]:
+                WITHDRAWALS["condition"].wait()
+            now = time.time()
+            # forget settled withdrawals, and those bittrex never reports closing
+            for wid, withdrawal in list(WITHDRAWALS["tracked"].items()):
+                if (
+                    withdrawal["completed"]
+                    and now - withdrawal["completed"] > WITHDRAWAL_SETTLE
+                ) or now - withdrawal["issued"] > WITHDRAWAL_EXPIRE:
+                    del WITHDRAWALS["tracked"][wid]
+            pending = {}
+            for wid, withdrawal in WITHDRAWALS["tracked"].items():
+                if not withdrawal["completed"]:
+                    pending.setdefault(withdrawal["api"], set()).add(wid)
+        closed, cancelled = [], []
+        for api, ids in pending.items():
+            try:
+                found = withdrawals_status(api, ids, keys)
             except Exception as error:
                 print(exception_handler(error), line_info())
-            balances[api] = balance
+                continue
+            with WITHDRAWALS["condition"]:
+                for wid, status in found.items():
+                    withdrawal = WITHDRAWALS["tracked"].get(wid)
+                    if withdrawal is None:
+                        continue
+                    withdrawal["status"] = status.get("status", withdrawal["status"])
+                    withdrawal["txId"] = status.get("txId") or withdrawal["txId"]
+                    if withdrawal["status"] == "COMPLETED" and withdrawal["txId"]:
+                        withdrawal["completed"] = time.time()
+                        closed.append(wid)
+                    elif withdrawal["status"] in ("CANCELLED", "ERROR_INVALID_ADDRESS"):
+                        # never arriving, so no longer in transit
+                        withdrawal["quantity"] = 0
+                        withdrawal["completed"] = time.time()
+                        closed.append(wid)
+                        cancelled.append((withdrawal["status"], wid))
+        # free the ledger keys of cancelled withdrawals to be attempted again
+        for status, wid in cancelled:
+            query = "UPDATE withdrawals SET status=?, updated=? WHERE withdrawal_id=?"
+            sql_db(query, (status.lower(), munix(), wid))
+        if closed:
+            print(it("yellow", f"bittrex withdrawals closed {closed}"))
+            with WITHDRAWALS["condition"]:
+                listeners = list(WITHDRAWALS["listeners"])
+            for condition in listeners:
+                with condition:
+                    condition.notify_all()
+        time.sleep(WITHDRAWAL_POLL)
+
+
+# RPC GET BALANCES
+@timed("stake_balance_bittrex_seconds")
+def get_balance_bittrex_api(api, keys):
+    """
+    get the BTS balance of one bittrex corporate account
+    :param int(api): 1, 2, or 3; corporate account
+    :param keys: dict containing api keys and secrets for 3 accounts
+    :return int(): available BTS, raises on any api error
+    """
+    # returns list() on success or dict() on error
+    return bittrex_available(get_bittrex(api, keys).get_balances())
+
+
+def bittrex_available(ret):
+    """
+    :param list(ret): response of Bittrex.get_balances()
+    :return int(): available BTS, raises on any api error
+    """
+    if isinstance(ret, dict):
+        raise ValueError(ret)
+    # ret balance will be strigified float; int(float(()) to return integer
+    # an account which has never held BTS has no BTS entry at all
+    available = [i["available"] for i in ret if i["currencySymbol"] == "BTS"]
+    return int(float(available[0])) if available else 0
+
+
+def get_balance_bittrex_report(keys):
+    """
+    get bittrex BTS balances for all three corporate accounts concurrently,
+    each account waits at most BALANCE_TIMEOUT seconds and never delays the others
+    :param keys: dict containing api keys and secrets for 3 accounts
+    :return tuple(dict(balances), dict(failed)):
+        balances format {1: 0, 2: 0, 3: 0} with int() BTS balance for each api;
+        failed format {api: str(reason)} for each api whose balance is unknown,
+        its balance is reported as 0 so it is never relied upon
+    """
+    balances = {1: NINES, 2: NINES, 3: NINES}
+    failed = {}
+    if not DEV:
+        # an account still stuck on an earlier request only delays itself,
+        # and is not sent another until that request returns
+        with BITTREX["lock"]:
+            for api in range(1, 4):
+                future = BITTREX["balances"].get(api)
+                if future is None or future.done():
+                    BITTREX["balances"][api] = BITTREX["executors"][api].submit(
+                        get_balance_bittrex_api, api, keys
+                    )
+            futures = dict(BITTREX["balances"])
+        futures_wait(futures.values(), timeout=BALANCE_TIMEOUT)
+        for api, future in futures.items():
+            balances[api] = 0
+            if not future.done():
+                failed[api] = f"timeout after {BALANCE_TIMEOUT} seconds"
+            elif future.exception() is not None:
+                failed[api] = exception_handler(future.exception())
+            else:
+                balances[api] = future.result()
     print("bittrex balances:", balances)
-    return balances
+    if failed:
+        print(it("red", "bittrex balances failed:"), failed, line_info())
+    return balances, failed
 
 
+def get_balance_bittrex(keys):
+    """
+    get bittrex BTS balances for all three corporate accounts
+    :param keys: dict containing api keys and secrets for 3 accounts
+    :return dict(balances):format {1: 0, 2: 0, 3: 0} with int() BTS balance for each api
+    """
+    return get_balance_bittrex_report(keys)[0]
+
+
+@timed("stake_balance_pybitshares_seconds")
 def get_balance_pybitshares():
     """
     get the broker's BTS balance
@@ -169,9 +989,9 @@ def get_balance_pybitshares():
         if DEV:
             balance = NINES
         else:
-            _, _ = pybitshares_reconnect()
-            account = Account(BROKER)
-            balance = int(account.balance("BTS")["amount"])
+            with pybitshares_connection() as (bitshares, _):
+                account = Account(BROKER, blockchain_instance=bitshares)
+                balance = int(account.balance("BTS")["amount"])
     except Exception as error:
         balance = 0
         print(exception_handler(error), line_info())
@@ -179,33 +999,158 @@ def get_balance_pybitshares():
     return balance
 
 
+# CACHED BALANCES
+def balance_broker(force=False):
+    """
+    the broker's BTS balance, fetched at most once per BALANCE_TTL seconds
+    concurrent callers share one fetch rather than each querying the node
+    :param bool(force): fetch now regardless of age
+    :return int(): cached BTS balance
+    """
+    with BALANCES["lock"]:
+        if force or time.time() - BALANCES["broker_fetched"] > BALANCE_TTL:
+            BALANCES["broker"] = get_balance_pybitshares()
+            BALANCES["broker_fetched"] = time.time()
+            BALANCES["broker_block"] = balance_broker_block()
+        return BALANCES["broker"]
+
+
+def balance_broker_block():
+    """
+    the head block number read just after the broker balance was fetched,
+    transfers in any later block are certainly not yet in the cached balance
+    :return int(): head block number, or NINES if unknown so nothing is credited
+    """
+    try:
+        fetch_block_height()
+        with HEIGHT["condition"]:
+            return HEIGHT["head"]
+    except Exception as error:
+        print(exception_handler(error), line_info())
+        return NINES
+
+
+def balance_available(force=False):
+    """
+    :param bool(force): fetch the broker balance now regardless of age
+    :return int(): broker BTS balance less funds reserved by payouts in flight
+    """
+    with BALANCES["lock"]:
+        return balance_broker(force) - BALANCES["reserved"]
+
+
+def balance_reserve(amount, force=False):
+    """
+    atomically reserve broker funds for a payout if enough remain unreserved
+    :param int(amount): BTS needed by the payout
+    :param bool(force): fetch the broker balance now regardless of age
+    :return bool(): True if reserved, release with balance_release() when sent
+    """
+    with BALANCES["lock"]:
+        if balance_available(force) < amount:
+            return False
+        BALANCES["reserved"] += amount
+        return True
+
+
+def balance_release(amount):
+    """
+    release a reservation made with balance_reserve()
+    :param int(amount): BTS previously reserved
+    :return None:
+    """
+    with BALANCES["lock"]:
+        BALANCES["reserved"] = max(BALANCES["reserved"] - amount, 0)
+
+
+def balance_adjust(delta):
+    """
+    optimistically apply a known transfer to the cached broker balance
+    :param int(delta): BTS received, or negative BTS sent
+    :return None:
+    """
+    with BALANCES["lock"]:
+        BALANCES["broker"] += delta
+
+
+def balance_receive(amount, block_num):
+    """
+    credit a transfer to the broker unless the cached balance already counts it
+    the listener sees irreversible blocks, the balance is fetched at the head,
+    so only transfers in blocks after that head are credited
+    :param int(amount): BTS received
+    :param int(block_num): block containing the transfer
+    :return bool(): True if credited
+    """
+    with BALANCES["lock"]:
+        if block_num <= BALANCES["broker_block"]:
+            return False
+        BALANCES["broker"] += amount
+        return True
+
+
+def balance_bittrex(keys, force=False):
+    """
+    bittrex balances of the three corporate accounts, fetched at most once per
+    BALANCE_TTL seconds, see get_balance_bittrex_report()
+    :param dict(keys): api keys and secrets for bittrex accounts
+    :param bool(force): fetch now regardless of age
+    :return tuple(dict(balances), dict(failed)):
+    """
+    with BALANCES["lock"]:
+        stale = time.time() - BALANCES["bittrex_fetched"] > BALANCE_TTL
+    # fetched outside the lock, reservations must not wait on BALANCE_TIMEOUT
+    if force or stale:
+        balance_bittrex_store(*get_balance_bittrex_report(keys))
+    with BALANCES["lock"]:
+        return dict(BALANCES["bittrex"]), dict(BALANCES["failed"])
+
+
+def balance_bittrex_store(balances, failed):
+    """
+    cache bittrex balances fetched elsewhere, eg. by the asyncio runtime
+    :param dict(balances): format {1: 0, 2: 0, 3: 0}
+    :param dict(failed): format {api: str(reason)}
+    :return None:
+    """
+    with BALANCES["lock"]:
+        BALANCES["bittrex"], BALANCES["failed"] = dict(balances), dict(failed)
+        BALANCES["bittrex_fetched"] = time.time()
+
+
+def balance_bittrex_adjust(api, delta):
+    """
+    optimistically apply a known withdrawal to a cached bittrex balance
+    :param int(api): 1, 2, or 3; corporate account
+    :param int(delta): negative BTS withdrawn
+    :return None:
+    """
+    with BALANCES["lock"]:
+        if api in BALANCES["bittrex"]:
+            BALANCES["bittrex"][api] += delta
+
+
 def authenticate(keys):
     """
     make authenticated request to pybitshares wallet and bittrex to test login
     :param dict(keys): bittrex api keys and pybitshares wallet password
     :return bool(): do all secrets and passwords authenticate?
     """
-    bitshares, _ = pybitshares_reconnect()
-    try:
-        bitshares.wallet.unlock(keys["password"])
-    except Exception:
-        pass
-    bitshares_auth = bitshares.wallet.unlocked()
-    if bitshares_auth:
-        print("PYBITSHARES WALLET AUTHENTICATED")
-    else:
-        print("PYBITSHARES WALLET AUTHENTICATION FAILED")
-    bitshares.wallet.lock()
+    with pybitshares_connection() as (bitshares, _):
+        try:
+            bitshares.wallet.unlock(keys["password"])
+        except Exception:
+            pass
+        bitshares_auth = bitshares.wallet.unlocked()
+        if bitshares_auth:
+            print("PYBITSHARES WALLET AUTHENTICATED")
+        else:
+            print("PYBITSHARES WALLET AUTHENTICATION FAILED")
+        bitshares.wallet.lock()
     bittrex_auth = {1: False, 2: False, 3: False}
     try:
-        for i in range(3):
-            api = i + 1
-            bittrex_api = Bittrex(
-                api_key=keys[f"api_{api}_key"], api_secret=keys[f"api_{api}_secret"]
-            )
-            ret = bittrex_api.get_balances()
-            if isinstance(ret, list):
-                bittrex_auth[api] = True
+        _, failed = get_balance_bittrex_report(keys)
+        bittrex_auth = {api: api not in failed for api in bittrex_auth}
     except Exception:
         pass
     if all(bittrex_auth.values()):
@@ -0,0 +1,79 @@
+"""
+BitShares.org StakeMachine
+Due Time Priority Scheduler for Pending Payments
+BitShares Management Group Co. Ltd.
+"""
+
+# STANDARD PYTHON MODULES
+import heapq
+import time
+from threading import Condition
+
+# STAKE BTS MODULES
+from config import SCHEDULE_RESYNC
+from utilities import it, munix, sql_db
+
+# min heap of (due, client, start) for every pending principal, interest and penalty
+SCHEDULE = {"heap": [], "condition": Condition()}
+
+
+def schedule_load():
+    """
+    rebuild the schedule from all pending rows in the stakes database
+    :return None:
+    """
+    query = "SELECT due, client, start FROM stakes WHERE status='pending'"
+    heap = [tuple(row) for row in sql_db(query)]
+    heapq.heapify(heap)
+    with SCHEDULE["condition"]:
+        SCHEDULE["heap"] = heap
+        SCHEDULE["condition"].notify_all()
+    print(it("purple", "schedule loaded"), len(heap), "pending items")
+
+
+def schedule_push(due, client, start):
+    """
+    add a pending payment to the schedule, waking the listener if now earliest
+    :param int(due): munix due date of this payment
+    :param str(client): bitshares username of staking client
+    :param int(start): munix start time of the contract
+    :return None:
+    """
+    with SCHEDULE["condition"]:
+        heapq.heappush(SCHEDULE["heap"], (due, client, start))
+        SCHEDULE["condition"].notify_all()
+
+
+def schedule_remove(client):
+    """
+    remove all of a client's pending payments from the schedule
+    :param str(client): bitshares username of staking client
+    :return None:
+    """
+    with SCHEDULE["condition"]:
+        SCHEDULE["heap"] = [i for i in SCHEDULE["heap"] if i[1] != client]
+        heapq.heapify(SCHEDULE["heap"])
+        SCHEDULE["condition"].notify_all()
+
+
+def schedule_wait():
+    """
+    sleep until the earliest scheduled payment is due, or SCHEDULE_RESYNC elapses;
+    on resync the schedule is rebuilt to pick up rows edited outside this process
+    :return int(): munix timestamp, every scheduled payment due before it is popped
+    """
+    resync = time.time() + SCHEDULE_RESYNC
+    with SCHEDULE["condition"]:
+        while time.time() < resync:
+            now = munix()
+            if SCHEDULE["heap"] and SCHEDULE["heap"][0][0] < now:
+                while SCHEDULE["heap"] and SCHEDULE["heap"][0][0] < now:
+                    heapq.heappop(SCHEDULE["heap"])
+                return now
+            timeout = resync - time.time()
+            if SCHEDULE["heap"]:
+                # stakes queries select due<now, so wake 1 ms after the due time
+                timeout = min(timeout, (SCHEDULE["heap"][0][0] - now + 1) / 1000)
+            SCHEDULE["condition"].wait(max(timeout, 0))
+    schedule_load()
+    return munix()
@@ -7,25 +7,34 @@ BitShares Management Group Co. Ltd.
 # pylint: disable=broad-except, invalid-name, bad-continuation
 # STANDARD MODULES
 import time
-from copy import deepcopy
 from getpass import getpass
 from json import dumps as json_dumps
-from json import loads as json_loads
-from threading import Thread
-
-# PYBITSHARES MODULES
-from bitshares.account import Account
-from bitshares.asset import Asset
-from bitshares.block import Block
+from threading import Condition, Thread
 
 # STAKE BTS MODULES
 from config import (ADMIN_REPLAY, BITTREX_1, BITTREX_2, BITTREX_3,
-                    BITTREX_ACCT, BROKER, DEV, EMAIL, INTEREST, INVEST_AMOUNTS,
-                    MANAGERS, PENALTY, REPLAY)
-from rpc import (authenticate, get_balance_bittrex, get_balance_pybitshares,
-                 get_block_num_current, post_withdrawal_bittrex,
-                 post_withdrawal_pybitshares, pybitshares_reconnect)
-from utilities import exception_handler, it, munix, munix_nonce, sql_db
+                    BITTREX_ACCT, BLOCK_CHECKPOINT, BROKER, COVER_TIMEOUT, DEV,
+                    EMAIL, INGEST, INTEREST, INVEST_AMOUNTS, MANAGERS,
+                    MEMO_BATCH, MEMO_REPLAY, PENALTY, REPLAY, TREASURY_POLL,
+                    WITHDRAWAL_POLL)
+from db_migrate import migrate
+from logger import log
+from memo_pool import memo_parse, memo_pool_decrypt
+from metrics import metric_gauge, metric_observe, metrics_serve, timed
+from payment_queue import (PARKED, payment_resume, payment_stats, payment_submit,
+                           payment_workers)
+from receipt_journal import journal_append, journal_flush, journal_stats
+from rpc import (authenticate, balance_available, balance_bittrex,
+                 balance_broker, balance_receive, balance_release,
+                 balance_reserve, cache_stats, get_account,
+                 get_asset_precision, get_block_num_current, get_blocks,
+                 get_broker_blocks, post_withdrawal_batched,
+                 post_withdrawal_bittrex, post_withdrawal_pybitshares,
+                 signer_memo_wif, signer_session, withdrawal_listen,
+                 withdrawals_in_transit, withdrawals_reconcile)
+from scheduler import schedule_load, schedule_push, schedule_remove, schedule_wait
+from utilities import (SQL, exception_handler, it, line_info, munix, munix_nonce,
+                       sql_db)
 
 # GLOBAL CONSTANTS
 MUNIX_MONTH = 86400 * 30 * 1000
@@ -46,6 +55,11 @@ MONTHS = {  # word phrase to number conversion
     "twelve_months": 12,
 }
 NINES = 999999999  # a default big number
+# blocks behind irreversible still served as live, listener_bitshares() sleeps 30s
+LIVE_BLOCKS = 20
+# payouts parked awaiting cover funds in arrival order, no worker is held meanwhile
+# and a count of payouts ever parked, so the treasury sees any added mid pass
+TREASURY = {"waiting": [], "parked": 0, "condition": Condition(), "thread": None}
 
 
 # SQL DATABASE GET AND SET BLOCK NUMBER
@@ -76,9 +90,8 @@ def update_receipt_database(nonce, msg):
     :param str(msg): auditable event documentation
     :return None:
     """
-    query = "INSERT INTO receipts (nonce, now, msg) VALUES (?,?,?)"
-    values = (nonce, munix(), msg)
-    sql_db(query, values)
+    # write behind, group committed by the receipt journal
+    journal_append(nonce, msg)
 
 
 # SQL DATABASE START, STOP, MARK PAID
@@ -207,16 +220,19 @@ def stake_start(params, keys=None):
         dml = {"query": query, "values": values}
         queries.append(dml)
     sql_db(queries)
+    # wake listener_sql() when principal, penalty and each interest payment come due
+    schedule_push(nonce + months * MUNIX_MONTH, client, nonce)
+    for month in range(1, months + 1):
+        schedule_push(nonce + month * MUNIX_MONTH, client, nonce)
 
 
-def stake_stop(params, keys):
+def stake_stop(params):
     """
-    send principal less penalty from pybitshares wallet
+    queue principal less penalty to be sent from pybitshares wallet
     update database with principal and penalty paid; outstanding interest aborted
     :param int(nonce): munix timestamp when stop signal was read from blockchain
     :param int(block_num): block number when this stake began
     :param str(client): bitshares username of staking client
-    :param dict(keys): pybitshares wallet password
     :return None:
     """
     # localize parameters
@@ -259,6 +275,7 @@ def stake_stop(params, keys):
     dml = {"query": query, "values": values}
     queries.append(dml)
     sql_db(queries)
+    schedule_remove(client)
     # SECURITY - make payouts after sql updates
     # send premature payment to client
     # total principals less total penalties
@@ -268,8 +285,9 @@ def stake_stop(params, keys):
         params["amount"] = amount
         params["number"] = 0
         params["type"] = "stop"
-        thread = Thread(target=payment_child, args=(deepcopy(params), keys,),)
-        thread.start()
+        # SECURITY - receipts so far are persisted before the payout is queued
+        journal_flush()
+        payment_submit(params)
     else:
         # no payouts if less than or equal to zero, add receipt to db, and print WARN
         msg = f"WARN {client} sent STOP in block {block_num}, "
@@ -331,7 +349,7 @@ def serve_client(params, keys):
     # existing client wishes to stop all his stake contracts prematurely
     elif memo["type"] == "stop":
         msg = f"received stop demand from {client} in {block_num}"
-        stake_stop(params, keys)
+        stake_stop(params)
     return msg
 
 
@@ -345,7 +363,8 @@ def serve_admin(params, keys):
     :return str(msg):
     """
     msg = "skipping admin actions during REPLAY" + json_dumps(params)
-    if ((get_block_num_current() - get_block_num_database()) < 10) or ADMIN_REPLAY:
+    # the age of the block being served, the database block only moves at checkpoints
+    if (get_block_num_current() - params["block_num"]) < LIVE_BLOCKS or ADMIN_REPLAY:
         # localize parameters
         memo, amount, client = map(params.get, ("memo", "amount", "client"))
         msg = f"admin request failed {(client, amount, memo)}"
@@ -356,7 +375,9 @@ def serve_admin(params, keys):
                 api = int(memo["api"])
                 assert api in [1, 2, 3]
                 assert transfer_amount > 400
-                msg = post_withdrawal_bittrex(transfer_amount, client, api, keys)
+                # keyed by chain position, so a replay of this block reuses the key
+                key = f"admin {params['block_num']}.{params['index']}"
+                msg = post_withdrawal_bittrex(transfer_amount, client, api, keys, key)
             except Exception as error:
                 msg = exception_handler(error)
                 print(msg)
@@ -406,7 +427,7 @@ def serve_invalid(params, keys):
         "admin_memo": memo["type"] in ADMIN_MEMOS,  # bool()
         "admin": client in MANAGERS,  # bool()
         "invest_amount": amount in INVEST_AMOUNTS,  # bool()
-        "ltm": Account(client).is_ltm,  # bool()
+        "ltm": get_account(client)["ltm"],  # bool()
         "memo": memo,  # client's memo
         "amount": amount,  # amount sent by client
         "client": client,  # bitshares user name
@@ -426,100 +447,151 @@ def serve_invalid(params, keys):
 
 
 # CHECK BLOCKS FOR INCOMING TRANSFERS
+@timed("stake_memo_decrypt_seconds")
 def decrypt_memo(ciphertext, keys):
     """
     using the memo key, decrypt the memo in the client's deposit
     """
     try:
-        _, memo = pybitshares_reconnect()
-        memo.blockchain.wallet.unlock(keys["password"])
-        decrypted_memo = memo.decrypt(ciphertext).replace(" ", "")
-        memo.blockchain.wallet.lock()
-        print("decrypted memo", decrypted_memo)
-        try:
-            msg = json_loads(decrypted_memo)
-        except Exception:
-            msg = {"type": decrypted_memo}
-        print(msg)
-        if "type" in msg:
-            if msg["type"] in CLIENT_MEMOS + ADMIN_MEMOS:
-                return msg
+        with signer_session(keys) as (_, memo):
+            decrypted_memo = memo.decrypt(ciphertext).replace(" ", "")
+        log("DEBUG", "decrypted memo", memo=decrypted_memo)
+        return memo_parse(decrypted_memo, CLIENT_MEMOS + ADMIN_MEMOS)
     except Exception:
         pass
     return {"type": "invalid"}
 
 
-def check_block(block_num, block, keys):
+def memo_prefetch(blocks, keys):
     """
-    check for client transfers to the broker in this block
-    :param int(block_num): block number associated with this block
+    during replay, decrypt the memos of MEMO_BATCH blocks at once on a process pool
+    so check_block() need not decrypt them inline
+    :param generator(blocks): yields tuple(int(block_num), dict(block)) in order
+    :param dict(keys): pybitshares wallet password
+    :yield tuple(int(block_num), dict(block), dict(memos)): memos by memo_id()
+    """
+    broker_id = get_account(keys["broker"])["id"]
+    wif = signer_memo_wif(keys)
+    batch = []
+    for block_num, block in blocks:
+        batch.append((block_num, block))
+        if len(batch) == MEMO_BATCH:
+            yield from memo_batch(batch, broker_id, wif)
+            batch = []
+    yield from memo_batch(batch, broker_id, wif)
+
+
+def memo_batch(batch, broker_id, wif):
+    """
+    decrypt the memos of broker transfers in a batch of blocks
+    :yield tuple(int(block_num), dict(block), dict(memos)): memos by memo_id()
+    """
+    ciphertexts = [
+        ops[1]["memo"]
+        for _, block in batch
+        for ops in broker_transfers(block, broker_id)
+        if "memo" in ops[1]
+    ]
+    decrypted = memo_pool_decrypt(wif, ciphertexts, CLIENT_MEMOS + ADMIN_MEMOS)
+    memos = {memo_id(i): j for i, j in zip(ciphertexts, decrypted)}
+    for block_num, block in batch:
+        yield block_num, block, memos
+
+
+def memo_id(ciphertext):
+    """
+    :param dict(ciphertext): memo of a transfer operation
+    :return tuple(): unique identity of the memo
+    """
+    return (str(ciphertext["nonce"]), ciphertext["message"])
+
+
+def broker_transfers(block, broker_id):
+    """
+    BTS transfers to the broker managed account in this block
     :param dict(block): block data
-    :param dict(keys): bittrex api keys and pybitshares wallet password
-    :return None:
+    :param str(broker_id): 1.2.x id of the broker
+    :yield list(ops): each transfer operation, in block order
     """
     for trx in block["transactions"]:
         for ops in trx["operations"]:
-            # if it is a BTS transfer to the broker managed account
             if (
                 ops[0] == 0  # withdrawal
-                and Account(ops[1]["to"]).name == keys["broker"]  # transfer to me
+                and ops[1]["to"] == broker_id  # transfer to me
                 and str(ops[1]["amount"]["asset_id"]) == "1.3.0"  # of BTS core token
             ):
-                nonce = munix_nonce()
-                client = Account(ops[1]["from"]).name
-                amount = int(
-                    ops[1]["amount"]["amount"] // 10 ** Asset("1.3.0").precision
-                )
-                msg = (
-                    f"transfer of {amount} BTS to broker from {client} "
-                    + f"in block {block_num}"
-                )
-                update_receipt_database(nonce, msg)
-                print(msg)
-                # provide timestamp, extract amount and client, dedode the memo
-                msg = ""
-                memo = ""
-                if "memo" in ops[1]:
-                    memo = decrypt_memo(ops[1]["memo"], keys)
-                params = {
-                    "client": client,
-                    "amount": amount,
-                    "memo": memo,
-                    "block_num": block_num,
-                    "ops": ops,
-                    "nonce": nonce,
-                }
-                print(it("green", "incoming transaction to broker"))
-                print(it("green", json_dumps(params)))
-                # handle requests to start and stop stakes
-                if memo["type"] == "stop" or (
-                    memo["type"] in CLIENT_MEMOS and amount in INVEST_AMOUNTS
-                ):
-                    msg = serve_client(params, keys)
-                # handle admin requests to move funds
-                elif (
-                    client in MANAGERS
-                    and memo["type"] in ADMIN_MEMOS
-                    # and Account(client).is_ltm
-                ):
-                    msg = serve_admin(params, keys)
-                # handle invalid requests
-                else:
-                    msg = serve_invalid(params, keys)
-                update_receipt_database(nonce, msg)
+                yield ops
+
+
+@timed("stake_check_block_seconds")
+def check_block(block_num, block, keys, memos=None):
+    """
+    check for client transfers to the broker in this block
+    :param int(block_num): block number associated with this block
+    :param dict(block): block data
+    :param dict(keys): bittrex api keys and pybitshares wallet password
+    :param dict(memos): memos already decrypted by memo_prefetch(), by memo_id()
+    :return int(): number of transfers to the broker served in this block
+    """
+    served = 0
+    memos = memos or {}
+    # compare raw 1.2.x ids, the broker's id is resolved once and then cached
+    broker_id = get_account(keys["broker"])["id"]
+    for index, ops in enumerate(broker_transfers(block, broker_id)):
+        served += 1
+        nonce = munix_nonce()
+        client = get_account(ops[1]["from"])["name"]
+        amount = int(ops[1]["amount"]["amount"] // 10 ** get_asset_precision("1.3.0"))
+        msg = f"transfer of {amount} BTS to broker from {client} in block {block_num}"
+        update_receipt_database(nonce, msg)
+        log("INFO", "transfer to broker", block_num=block_num, client=client)
+        # credited only if the block is newer than the cached broker balance
+        balance_receive(amount, block_num)
+        # provide timestamp, extract amount and client, dedode the memo
+        msg = ""
+        memo = ""
+        if "memo" in ops[1]:
+            memo = memos.get(memo_id(ops[1]["memo"]))
+            if memo is None:
+                memo = decrypt_memo(ops[1]["memo"], keys)
+        params = {
+            "client": client,
+            "amount": amount,
+            "memo": memo,
+            "block_num": block_num,
+            "index": index,  # of this transfer among the block's transfers to broker
+            "ops": ops,
+            "nonce": nonce,
+        }
+        log("INFO", "incoming transaction to broker", **params)
+        # handle requests to start and stop stakes
+        if memo["type"] == "stop" or (
+            memo["type"] in CLIENT_MEMOS and amount in INVEST_AMOUNTS
+        ):
+            msg = serve_client(params, keys)
+        # handle admin requests to move funds
+        elif (
+            client in MANAGERS
+            and memo["type"] in ADMIN_MEMOS
+            # and Account(client).is_ltm
+        ):
+            msg = serve_admin(params, keys)
+        # handle invalid requests
+        else:
+            msg = serve_invalid(params, keys)
+        update_receipt_database(nonce, msg)
+    return served
 
 
 # HANDLE PAYMENTS
-def payment_parent(payments_due, keys):
+def payment_parent(payments_due):
     """
-    spawn payment threads
+    queue payments for the bounded payment_workers() pool
     :param matrix(payments_due): list of payments due;
         each with amount, client, nonce, number
     :return None:
     """
-    threads = {}
     for payment in payments_due:
-        time.sleep(0.1)  # reduce likelihood of race condition
         params = {
             "amount": payment[0],
             "client": payment[1],
@@ -527,11 +599,9 @@ def payment_parent(payments_due, keys):
             "number": payment[3],
             "type": payment[4],
         }
-        # each individual outbound payment_child()
-        # is a child of listener_sql(),
-        # we'll use deepcopy so that the thread's locals are static to the payment
-        threads[payment] = Thread(target=payment_child, args=(deepcopy(params), keys,),)
-        threads[payment].start()
+        # each individual outbound payment_child() is persisted to the payments table
+        # and run by a worker, one at a time per client in order of submission
+        payment_submit(params)
 
 
 def payment_child(params, keys):
@@ -554,21 +624,27 @@ def payment_child(params, keys):
     :params int(nonce): munix timestamp *originally* associated with this stake
     :params int(number): the counting number of this interest payment
     :param dict(keys): pybitshares wallet password
-    :return None:
+    :return str(): PARKED while the treasury covers this payout, otherwise None
     """
     # localize params
     amount, client, nonce, number = map(
         params.get, ("amount", "client", "nonce", "number")
     )
     print(it("green", str(("make payout process", amount, client, nonce, number))))
-    # calculate need vs check how much funds we have on hand in the brokerage account
-    params.update(
-        {"need": amount + 100, "pybitshares_balance": get_balance_pybitshares()}
-    )
-    # if we don't have enough we'll have to move some BTS from bittrex to broker
-    covered = True
-    if params["pybitshares_balance"] < params["need"]:
-        covered = payment_cover(params, keys)
+    if "covered" in params:
+        # resumed by the treasury, if covered its funds are already reserved
+        covered = params.pop("covered")
+    else:
+        # calculate need vs check how much funds we have on hand in the brokerage
+        # account reserving them, so concurrent payouts never count funds twice
+        params["need"] = amount + 100
+        covered = balance_reserve(params["need"])
+        params["pybitshares_balance"] = balance_available()
+        # if we don't have enough we'll have to move some BTS from bittrex to broker
+        # the payout is parked with the treasury, freeing this worker meanwhile
+        if not covered:
+            payment_cover(params, keys)
+            return PARKED
     # assuming we have enough, just pay the client his due
     # mark as paid, post withdrawal, add receipt to db
     if covered:
@@ -576,9 +652,15 @@ def payment_child(params, keys):
             f"Payment for stakeBTS nonce {nonce} type {params['type']} {number}, "
             + "we appreciate your business!"
         )
-        stake_paid(params)
-        # SECURITY - after it has been marked as paid...
-        msg = memo + post_withdrawal_pybitshares(amount, client, memo, keys)
+        try:
+            stake_paid(params)
+            # SECURITY - and its receipts persisted
+            journal_flush()
+            # SECURITY - after it has been marked as paid...
+            # batched with other payouts due, but receipted individually
+            msg = memo + post_withdrawal_batched(amount, client, memo, keys)
+        finally:
+            balance_release(params["need"])
         msg += json_dumps(params)
         update_receipt_database(nonce, msg)
     # something went wrong, send the client an IOU with support details
@@ -589,7 +671,7 @@ def payment_child(params, keys):
             + f"please contact {EMAIL} "
             + f"BTSstake nonce {nonce} type {params['type']} {number}"
         )
-        msg = memo + post_withdrawal_pybitshares(1, client, memo, keys)
+        msg = memo + post_withdrawal_batched(1, client, memo, keys)
         msg += json_dumps(params)
         update_receipt_database(nonce, msg)
 
@@ -597,65 +679,152 @@ def payment_child(params, keys):
 def payment_cover(params, keys):
     """
     when there are not enough funds in pybitshares wallet
-    move some funds from bittrex, check all 3 corporate api accounts
-    :param int(need): the amount due to client + 10
-    :param str(client): the amount in broker account
+    park the payout with the treasury, which moves funds from bittrex covering all
+    parked payouts at once, then resumes each with params["covered"] set
+    :param int(need): the amount due to client + 100
     :param dict(keys): pybitshares wallet password and bittrex keys
     :param int(nonce): munix timestamp *originally* associated with this stake
     :param int(number): the counting number of this interest payment
-    :return bool(): whether of not we have enough funds to cover this payment
+    :return None:
     """
-    # localize params
-    need, pybitshares_balance, nonce = map(
-        params.get, ("need", "pybitshares_balance", "nonce")
+    waiter = {"params": params, "parked": time.time()}
+    with TREASURY["condition"]:
+        TREASURY["waiting"].append(waiter)
+        TREASURY["parked"] += 1
+        if TREASURY["thread"] is None:
+            # woken early whenever a bittrex withdrawal closes
+            withdrawal_listen(TREASURY["condition"])
+            TREASURY["thread"] = Thread(target=treasury, args=(keys,), daemon=True)
+            TREASURY["thread"].start()
+        TREASURY["condition"].notify_all()
+
+
+# TREASURY
+def treasury_plan(deficit, bittrex_balance):
+    """
+    plan the fewest bittrex withdrawals to cover a deficit, largest account first
+    :param int(deficit): BTS needed in the brokerage account
+    :param dict(bittrex_balance): format {1: 0, 2: 0, 3: 0} BTS balance for each api
+    :return list(tuple(int(api), int(qty))): withdrawals to make
+    """
+    plan = []
+    for api in sorted(bittrex_balance, key=bittrex_balance.get, reverse=True):
+        bittrex_available = bittrex_balance[api]
+        if deficit > 0 and bittrex_available > 510:
+            # at last check bittrex charges 5 BTS to withdraw
+            # presume 10 for safe measure
+            qty = min(deficit, bittrex_available - 10)
+            plan.append((api, qty))
+            deficit -= qty
+    return plan
+
+
+def treasury_release(waiters, covered):
+    """
+    resume parked payouts in bulk, ahead of the rest of the payment queue
+    :param list(waiters): from TREASURY["waiting"]
+    :param bool(covered): whether their funds are reserved
+    :return None:
+    """
+    for waiter in waiters:
+        metric_observe("stake_payment_cover_seconds", time.time() - waiter["parked"])
+        waiter["params"]["covered"] = covered
+        payment_resume(waiter["params"])
+        # only once resumed, so a failed resume is retried on the next pass
+        with TREASURY["condition"]:
+            TREASURY["waiting"].remove(waiter)
+
+
+def treasury_cover(waiting, keys):
+    """
+    one pass of the treasury over a snapshot of the waiting payouts
+    :param list(waiting): from TREASURY["waiting"]
+    :param dict(keys): bittrex api keys and pybitshares wallet password
+    :return int(): BTS withdrawn from bittrex and still in transit to the broker
+    """
+    # fail payouts which waited COVER_TIMEOUT, 12 hours, for bittrex funds
+    expired = [i for i in waiting if time.time() - i["parked"] > COVER_TIMEOUT]
+    for waiter in expired:
+        msg = f"WARN: nonce {waiter['params']['nonce']} funds failed to arrive"
+        print(it("purple", msg))
+        update_receipt_database(waiter["params"]["nonce"], msg)
+    treasury_release(expired, False)
+    waiting = [i for i in waiting if i not in expired]
+    # release waiting payouts in bulk, oldest first, as funds arrive
+    balance_broker(force=True)
+    released = [i for i in waiting if balance_reserve(i["params"]["need"])]
+    treasury_release(released, True)
+    waiting = [i for i in waiting if i not in released]
+    # cover funds withdrawn but not yet seen in the broker balance
+    in_transit = withdrawals_in_transit()
+    deficit = (
+        sum(i["params"]["need"] for i in waiting) - balance_available() - in_transit
     )
-    # can we afford to cover client's payout?
-    covered = False
-    try:
-        # calculate our deficit and and fetch our bittrex account balances
-        deficit = need - pybitshares_balance
-        bittrex_balance = get_balance_bittrex(keys)  # returns dict()
-        # assuming we can cover it with bittrex balances
-        if sum(bittrex_balance.values()) > deficit:
-            # we start moving funds until we have just enough in the brokerage acct
-            for api in range(1, 4):
-                bittrex_available = bittrex_balance[api]
-                if bittrex_available > 510:
-                    # at last check bittrex charges 5 BTS to withdraw
-                    # presume 10 for safe measure
-                    qty = min(deficit, bittrex_available - 10)
-                    msg = "cover payment"
-                    msg += post_withdrawal_bittrex(qty, BROKER, api, keys)
-                    msg += json_dumps(params)
-                    update_receipt_database(nonce, msg)
-                    deficit -= qty
-                    if deficit <= 0:
-                        break  # eg. if 1st api has funds stop here
-        # if we had enough funds,
-        # wait up to 6 hours for funds to arrive
-        # breaks on timeout or on receipt of funds
-        if deficit <= 0:
-            covered = True
-            begin = time.time()
-            while get_balance_pybitshares() < need:
-                time.sleep(120)
-                # calculate elapsed time in MINUTES
-                elapsed = int((time.time() - begin) / 60)
-                msg = it(
-                    "purple",
-                    f"Awaiting on funds from Bittrex for nonce {nonce}, "
-                    + f"minutes elapsed {elapsed}",
+    if deficit > 0:
+        bittrex_balance, failed = balance_bittrex(keys)
+        if failed:
+            msg = "cover payment, bittrex balances unavailable "
+            update_receipt_database(munix(), msg + json_dumps(failed))
+        # fail the newest payouts which cannot be covered at all, unless a balance
+        # is unknown, then they stay parked and retry until COVER_TIMEOUT
+        coverable = sum(qty for _, qty in treasury_plan(NINES, bittrex_balance))
+        if failed:
+            coverable = NINES
+        while waiting and deficit > coverable:
+            deficit -= waiting[-1]["params"]["need"]
+            treasury_release([waiting.pop()], False)
+        nonces = [i["params"]["nonce"] for i in waiting]
+        # the same payouts are never covered twice from the same account
+        payouts = ",".join(
+            f"{i['params']['nonce']}.{i['params']['type']}.{i['params']['number']}"
+            for i in waiting
+        )
+        for api, qty in treasury_plan(deficit, bittrex_balance):
+            msg = "cover payment"
+            key = f"cover {api} {payouts}"
+            msg += post_withdrawal_bittrex(qty, BROKER, api, keys, key)
+            msg += json_dumps({"deficit": deficit, "nonces": nonces})
+            for nonce in nonces:
+                update_receipt_database(nonce, msg)
+            # tracked by its withdrawal id from here on
+            in_transit += qty
+    if waiting:
+        msg = it(
+            "purple",
+            f"Awaiting on funds from Bittrex for {len(waiting)} payouts, "
+            + f"deficit {deficit}, in transit {in_transit}",
+        )
+        print(msg)
+    return in_transit
+
+
+def treasury(keys):
+    """
+    single cover planner for all underfunded payouts
+    releases waiting payouts as funds arrive, then withdraws the total deficit
+    of the rest from bittrex once, rather than once per payout
+    :param dict(keys): bittrex api keys and pybitshares wallet password
+    """
+    while True:
+        with TREASURY["condition"]:
+            while not TREASURY["waiting"]:
+                TREASURY["condition"].wait()
+            waiting = list(TREASURY["waiting"])
+            parked = TREASURY["parked"]
+        in_transit = 0
+        try:
+            in_transit = treasury_cover(waiting, keys)
+        except Exception as error:
+            # the treasury must outlive any one pass, parked payouts depend on it
+            print(exception_handler(error), line_info())
+            log("ERROR", "treasury pass failed", error=str(error))
+        with TREASURY["condition"]:
+            # payouts parked during this pass missed its notify, plan for them now
+            if TREASURY["parked"] == parked:
+                # check often while cover funds are in transit
+                TREASURY["condition"].wait(
+                    WITHDRAWAL_POLL if in_transit else TREASURY_POLL
                 )
-                print(msg)
-                # wait up to 12 hours for bittrex funds to arrive
-                if elapsed > 60 * 12:
-                    print(it("purlple", f"WARN: nonce {nonce} funds failed to arrive"))
-                    covered = False
-                    break
-    except Exception as error:
-        error = "cover payment failed" + json_dumps(params) + error
-        update_receipt_database(nonce, error)
-    return covered
 
 
 # LISTENER THREADS
@@ -663,91 +832,130 @@ def listener_bitshares(keys):
     """
     get the last block number checked from the database
     and the latest block number from the node
-    check each block in between for stake related transfers from clients
-    then update the last block checked in the database
+    prefetch each block in between and check it for stake related transfers
+    then update the last block checked in the database every BLOCK_CHECKPOINT blocks
+    when INGEST is "history" only blocks with transfers to the broker are checked
+    more than MEMO_REPLAY blocks behind, memos are decrypted on a process pool
     :param dict(keys): bittrex api keys and pybitshares wallet password
     """
+    source = get_broker_blocks if INGEST == "history" else get_blocks
     while True:
         block_last = get_block_num_database()
         block_new = get_block_num_current()
-        for block_num in range(block_last + 1, block_new + 1):
+        begin = time.time()
+        blocks = source(block_last + 1, block_new)
+        if block_new - block_last > MEMO_REPLAY:
+            blocks = memo_prefetch(blocks, keys)
+        else:
+            blocks = ((block_num, block, None) for block_num, block in blocks)
+        for block_num, block, memos in blocks:
             if block_num % 20 == 0:
-                print(
-                    it("blue", str((block_num, time.ctime(), int(1000 * time.time()))))
-                )
-            block = Block(block_num)
-            Block.clear_cache()
-            check_block(block_num, block, keys)
-            set_block_num_database(block_num)
+                # blocks per second checked during this catch up, to tune BLOCK_WINDOW
+                rate = round((block_num - block_last) / (time.time() - begin), 1)
+                log("INFO", "blocks", block_num=block_num, rate=rate)
+            # SECURITY - checkpoint immediately after serving any transfer,
+            # so a restart never replays a payout; otherwise checkpoint in batches
+            if (
+                check_block(block_num, block, keys, memos)
+                or block_num % BLOCK_CHECKPOINT == 0
+            ):
+                set_block_num_database(block_num)
+        if block_new > block_last:
+            set_block_num_database(block_new)
         time.sleep(30)
 
 
-def listener_sql(keys):
+def listener_sql():
     """
     make all interest and principal payments due and marke them paid in database
     mark penalties due as aborted in database
     set processed time and block to current for all
     send individual payments using threading
-    :param dict(keys): pybitshares wallet password
+    sleeps until the next payment is due rather than polling the database
     """
+    schedule_load()
     while True:
-        # get millesecond timestamp and current block number
-        now = munix()
-        block_num = get_block_num_current()
-        # read from database gather list of payments due
-        query = (
-            "SELECT amount, client, start, number, type FROM stakes "
-            + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'"
-        )
-        values = (now,)
-        payments_due = sql_db(query, values)
-        # gather list of contracts that have matured
-        query = (
-            "SELECT amount, client, start, number FROM stakes "
-            + "WHERE type='penalty' AND due<? AND status='pending'"
-        )
-        values = (now,)
-        closed_contracts = sql_db(query, values)  # strictly for printing
-        print(
-            it("green", "payments due"),
-            payments_due,
-            it("red", "closed contracts"),
-            closed_contracts,
-        )
-        # batch payment due queries and process them atomically
-        queries = []
-        # update principal and interest due status to processing
-        query = (
-            "UPDATE stakes "
-            + "SET status='processing', block_processed=?, processed=? "
-            + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'"
-        )
-        values = (block_num, now, now)
-        dml = {"query": query, "values": values}
-        queries.append(dml)
-        # update penalties due to status aborted
-        query = (
-            "UPDATE stakes "
-            + "SET status='aborted', block_processed=?, processed=? "
-            + "WHERE type='penalty' AND due<? AND status='pending'"
-        )
-        values = (block_num, now, now)
-        dml = {"query": query, "values": values}
-        queries.append(dml)
-        sql_db(queries)
-        # make the payments due
-        payment_parent(payments_due, keys)
-        time.sleep(60)
+        # wait for the next payment due, then get millesecond timestamp
+        now = schedule_wait()
+        payments_process(now)
+
+
+def payments_process(now):
+    """
+    mark payments due as processing and penalties due as aborted, then pay them
+    :param int(now): munix timestamp, everything due before it is processed
+    :return None:
+    """
+    block_num = get_block_num_current()
+    # read from database gather list of payments due
+    query = (
+        "SELECT amount, client, start, number, type FROM stakes "
+        + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'"
+    )
+    values = (now,)
+    payments_due = sql_db(query, values)
+    # gather list of contracts that have matured
+    query = (
+        "SELECT amount, client, start, number FROM stakes "
+        + "WHERE type='penalty' AND due<? AND status='pending'"
+    )
+    values = (now,)
+    closed_contracts = sql_db(query, values)  # strictly for printing
+    print(
+        it("green", "payments due"),
+        payments_due,
+        it("red", "closed contracts"),
+        closed_contracts,
+    )
+    # batch payment due queries and process them atomically
+    queries = []
+    # update principal and interest due status to processing
+    query = (
+        "UPDATE stakes "
+        + "SET status='processing', block_processed=?, processed=? "
+        + "WHERE (type='principal' OR type='interest') AND due<? AND status='pending'"
+    )
+    values = (block_num, now, now)
+    dml = {"query": query, "values": values}
+    queries.append(dml)
+    # update penalties due to status aborted
+    query = (
+        "UPDATE stakes "
+        + "SET status='aborted', block_processed=?, processed=? "
+        + "WHERE type='penalty' AND due<? AND status='pending'"
+    )
+    values = (block_num, now, now)
+    dml = {"query": query, "values": values}
+    queries.append(dml)
+    sql_db(queries)
+    # make the payments due
+    payment_parent(payments_due)
 
 
 def listener_balances(keys):
     """
     about every 2 hours update receipts table with current account balances
     """
-    balances = {0: get_balance_pybitshares()}
-    balances.update(get_balance_bittrex(keys))
+    balances_report(keys)
+    time.sleep(7195)
+
+
+def balances_report(keys, force=True):
+    """
+    print and receipt account balances, warn if payments due in 24 hours exceed them
+    :param dict(keys): bittrex api keys
+    :param bool(force): fetch balances now rather than use those cached
+    :return None:
+    """
+    balances = {0: balance_broker(force=force)}
+    bittrex_balances, failed = balance_bittrex(keys, force=force)
+    balances.update(bittrex_balances)
     print(it("purple", "balances"), balances)
-    update_receipt_database(0, json_dumps(balances))
+    print(it("purple", "object caches"), cache_stats())
+    print(it("purple", "payment queue"), payment_stats())
+    print(it("purple", "receipt journal"), journal_stats())
+    # make unknown bittrex balances explicit in the audit trail rather than just 0
+    update_receipt_database(0, json_dumps({**balances, "failed": failed}))
     now = munix()
     # read from database gather list of payments due in next 24 hours
     query = (
@@ -762,16 +970,34 @@ def listener_balances(keys):
         print(it("red", "WARN INSUFFICIENT FUNDS IN LOCAL WALLET FOR 24 HOUR EXPENSES"))
     if due_today > sum(balances.values()):
         print(it("red", "WARN INSUFFICIENT FUNDS IN ALL WALLETS FOR 24 HOUR EXPENSES"))
-    time.sleep(7195)
 
 
 # PRIMARY EVENT BACKBONE
+def metrics_start():
+    """
+    export block lag and queue depths as gauges and serve the metrics endpoint
+    :return None:
+    """
+    metric_gauge(
+        "stake_block_lag", lambda: get_block_num_current() - get_block_num_database()
+    )
+    metric_gauge("stake_payments_queued", lambda: payment_stats()["queued"])
+    metric_gauge("stake_payments_running", lambda: payment_stats()["running"])
+    metric_gauge("stake_receipts_pending", lambda: journal_stats()["pending"])
+    metric_gauge("stake_sql_write_queue", SQL["queue"].qsize)
+    metric_gauge("stake_treasury_waiting", lambda: len(TREASURY["waiting"]))
+    metric_gauge("stake_withdrawals_in_transit", withdrawals_in_transit)
+    metrics_serve()
+
+
 def welcome(keys):
     """
     UX at startup
     """
     block_num_current = get_block_num_current()
     print(it("blue", f"\033c\n{keys['broker'].upper()} AUTHENTICATED\n"))
+    # resolve the broker's account id once, check_block() compares raw ids
+    print("broker account id:", get_account(keys["broker"])["id"])
     # display developer mode, replay type, and current block number locally vs actual
     if DEV:
         print(it("red", "\n     *** DEVELOPER MODE ***\n\n"))
@@ -839,14 +1065,21 @@ def main():
     login then begin while loop listening for client requests and making timely payouts
     """
     keys = login()
+    # upgrade an existing database schema in place before any listener reads it
+    migrate()
     welcome(keys)
+    # resolve bittrex withdrawals whose outcome a crash or timeout left unknown
+    withdrawals_reconcile(keys)
+    metrics_start()
+    # bounded pool of payout workers serving the persistent payments queue
+    payment_workers(payment_child, keys)
     # branch into three run forever threads with run forever while loops
     # ==================================================================================
     # block operations listener_bitshares() for incoming client requests
     thread_1 = Thread(target=listener_bitshares, args=(keys,))
     thread_1.start()
     # listener_sql() check sql db for payments due
-    thread_2 = Thread(target=listener_sql, args=(keys,))
+    thread_2 = Thread(target=listener_sql)
     thread_2.start()
     # listener_balances() periodically updates receipts table with account balances
     thread_3 = Thread(target=listener_balances, args=(keys,))
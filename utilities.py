@@ -8,12 +8,21 @@ BitShares Management Group Co. Ltd.
 # pylint: disable=broad-except, bad-continuation, invalid-name
 
 # STANDARD PYTHON MODULES
-import inspect
+import sys
 import time
+from collections import OrderedDict
+from queue import Queue
+from sqlite3 import OperationalError
 from sqlite3 import connect as sql
+from threading import Lock, Thread, local
 
 # STAKE BTS MODULES
-from config import DB
+from config import DB, DB_CACHE, DB_TIMEOUT
+from logger import log
+from metrics import metric_inc, metric_observe
+
+# one writer thread fed by a queue, and a read connection held by each thread
+SQL = {"queue": Queue(), "writer": None, "lock": Lock(), "readers": local()}
 
 
 def it(style, text, foreground=True):
@@ -61,8 +70,9 @@ def line_info():
     """
     :return str(): red formatted function and line number
     """
-    info = inspect.getframeinfo(inspect.stack()[1][0])
-    return it("red", "function " + str(info.function) + " line " + str(info.lineno))
+    # the caller's frame only, inspect.stack() would read every frame's source
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    return it("red", f"function {frame.f_code.co_name} line {frame.f_lineno}")
 
 
 def exception_handler(error):
@@ -72,11 +82,158 @@ def exception_handler(error):
     return it("red", f"{type(error).__name__} {error.args}")
 
 
+class LRUCache:
+    """
+    thread safe least recently used cache with time to live and hit/miss counters
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, fetch):
+        """
+        :param key: hashable cache key
+        :param callable(fetch): called with key to fetch the value on miss or expiry
+        :return: the cached or freshly fetched value
+        """
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and time.time() - item[0] < self.ttl:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        value = fetch(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        :param key: hashable cache key
+        :param value: value to cache, evicting the least recently used if full
+        :return None:
+        """
+        with self.lock:
+            self.data[key] = (time.time(), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        """
+        :return dict(): hits, misses and current number of cached items
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.data)}
+
+
+def sql_connect():
+    """
+    open a sqlite connection with tuned synchronous and cache pragmas
+    :return object(con): sqlite3 connection
+    """
+    con = sql(DB, timeout=DB_TIMEOUT)
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA cache_size=-{DB_CACHE}")
+    return con
+
+
+def sql_execute(con, queries):
+    """
+    execute a batch of queries atomically, retry while the database is locked
+    :param object(con): sqlite3 connection
+    :param list(queries): list of dicts with keys ["query","values"]
+        and optionally "many": True to executemany() a list of values
+    :return tuple(curfetchall, error): last SELECT result and any non lock error
+    """
+    pause = 0
+    while True:
+        curfetchall = None
+        begin = time.time()
+        try:
+            cur = con.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            for dml in queries:
+                if dml.get("many"):
+                    cur.executemany(dml["query"], dml["values"])
+                    continue
+                cur.execute(dml["query"], dml["values"])
+                if "SELECT" in dml["query"] or "PRAGMA table_info" in dml["query"]:
+                    curfetchall = cur.fetchall()
+            con.commit()
+            metric_observe("stake_sql_execute_seconds", time.time() - begin)
+            return curfetchall, None
+        except Exception as error:
+            con.rollback()
+            # OperationalError: database is locked
+            if not (
+                isinstance(error, OperationalError)
+                and ("locked" in str(error) or "busy" in str(error))
+            ):
+                return None, error
+            metric_inc("stake_sql_lock_retries_total")
+            print(exception_handler(error), line_info())
+            time.sleep(0.1 * 2 ** pause)
+            if pause < 13:  # oddly works out to about 13 minutes
+                pause += 1
+            continue
+
+
+def sql_writer():
+    """
+    the only thread which writes to the database, serving batches from the queue
+    :return None:
+    """
+    con = sql_connect()
+    con.execute("PRAGMA journal_mode=WAL")
+    while True:
+        queries, reply = SQL["queue"].get()
+        reply.put(sql_execute(con, queries))
+
+
+def sql_read(queries):
+    """
+    execute read only queries on this thread's persistent connection
+    :param list(queries): list of dicts with keys ["query","values"]
+    :return cur.fetchall(): from last SELECT or PRAGMA query made
+    """
+    readers = SQL["readers"]
+    pause = 0
+    while True:
+        try:
+            if getattr(readers, "con", None) is None:
+                readers.con = sql_connect()
+            cur = readers.con.cursor()
+            for dml in queries:
+                cur.execute(dml["query"], dml["values"])
+                curfetchall = cur.fetchall()
+            return curfetchall
+        # OperationalError: database is locked
+        except Exception as error:
+            metric_inc("stake_sql_read_retries_total")
+            print(exception_handler(error), line_info())
+            # sql_connect() itself may have raised
+            if getattr(readers, "con", None) is not None:
+                readers.con.close()
+            readers.con = None
+            time.sleep(0.1 * 2 ** pause)
+            if pause < 13:  # oddly works out to about 13 minutes
+                pause += 1
+            continue
+
+
 def sql_db(query, values=()):
     """
     execute discrete sql queries, handle race condition gracefully
     if query is a string, assume values is a tuple
     else, query can be a list of dicts with keys ["query","values"]
+    read only batches run on a per thread connection, all others are queued
+    to a single writer thread and committed atomically in WAL journal mode
 
     :return None: when not a SELECT query
     :return cur.fetchall(): from single SELECT, or last SELECT query made
@@ -95,27 +252,20 @@ def sql_db(query, values=()):
             and "SET status='processing'" not in dml["query"]
             and "WHERE type='penalty' AND due<?" not in dml["query"]
         ):
-            print(it("yellow", f"'query': {dml['query']}"))
-            print(it("green", f"'values': {dml['values']}\n"))
+            log("DEBUG", "sql", query=dml["query"], values=dml["values"])
 
-    pause = 0
-    curfetchall = None
-    while True:
-        try:
-            con = sql(DB)
-            cur = con.cursor()
-            for dml in queries:
-                cur.execute(dml["query"], dml["values"])
-                if "SELECT" in dml["query"] or "PRAGMA table_info" in dml["query"]:
-                    curfetchall = cur.fetchall()
-            con.commit()
-            break
-        # OperationalError: database is locked
-        except Exception as error:
-            print(exception_handler(error), line_info())
-            time.sleep(0.1 * 2 ** pause)
-            if pause < 13:  # oddly works out to about 13 minutes
-                pause += 1
-            continue
-    con.close()
+    if all(
+        dml["query"].strip().upper().startswith(("SELECT", "PRAGMA"))
+        for dml in queries
+    ):
+        return sql_read(queries)
+    with SQL["lock"]:
+        if SQL["writer"] is None:
+            SQL["writer"] = Thread(target=sql_writer, daemon=True)
+            SQL["writer"].start()
+    reply = Queue(maxsize=1)
+    SQL["queue"].put((queries, reply))
+    curfetchall, error = reply.get()
+    if error is not None:
+        raise error
     return curfetchall